@@ -14,8 +14,16 @@ import base64
 import asyncio
 import logging
 import dotenv
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from signal import SIGINT, SIGTERM
 
+try:
+    import uvloop # type: ignore[import]
+    HAVE_UVLOOP = True
+except ImportError:
+    HAVE_UVLOOP = False
+
 from anthem_receiver.internal_types import *
 
 from anthem_receiver import (
@@ -27,9 +35,49 @@ from anthem_receiver.discovery import (
     AnthemDpClient,
     AnthemDpSearchRequest,
     AnthemDpAdvertisementInfo,
+    AnthemDpResponseInfo,
     ANTHEM_DP_DEFAULT_RESPONSE_WAIT_TIME,
   )
 
+SEARCH_OUTPUT_FLUSH_DELAY = 0.05
+"""The time (in seconds) that search results are buffered before stdout is flushed, so that
+   a burst of responses is written with a single flush."""
+
+MAX_PENDING_SEARCH_OUTPUT = 100
+"""The maximum number of search results that may be waiting to be encoded and written before
+   the search command stops reading further responses."""
+
+SUMMARY_KEYS = (
+    "device_name",
+    "dp_version",
+    "is_off",
+    "local_addr",
+    "model_name",
+    "monotonic_time",
+    "serial_number",
+    "src_addr",
+    "tcp_port",
+    "utc_time",
+  )
+"""The keys of a JSON response summary, in sorted order."""
+
+def summarize_response(info: Union[AnthemDpAdvertisementInfo, AnthemDpResponseInfo]) -> JsonableDict:
+    """Returns a JSON-serializable summary of a received advertisement or search response,
+       with keys in sorted order."""
+    datagram = info.datagram
+    return dict(zip(SUMMARY_KEYS, (
+        datagram.device_name,
+        datagram.dp_version,
+        datagram.is_off,
+        f"{info.socket_binding.unicast_addr[0]}:{info.socket_binding.unicast_addr[1]}",
+        datagram.model_name,
+        info.monotonic_time,
+        datagram.serial_number,
+        f"{info.src_addr[0]}:{info.src_addr[1]}",
+        datagram.tcp_port,
+        info.utc_time.isoformat(),
+      )))
+
 class CmdExitError(RuntimeError):
     exit_code: int
 
@@ -63,26 +111,10 @@ class CommandHandler:
 
     async def cmd_server(self) -> int:
         async def notify_handler(info: AnthemDpAdvertisementInfo) -> None:
-            results: List[JsonableDict] = []
-            datagram = info.datagram
-            summary: JsonableDict = {
-                "dp_version": datagram.dp_version,
-                "is_off": datagram.is_off,
-                "tcp_port": datagram.tcp_port,
-                "device_name": datagram.device_name,
-                "model_name": datagram.model_name,
-                "serial_number": datagram.serial_number,
-                "src_addr": f"{info.src_addr[0]}:{info.src_addr[1]}",
-                "local_addr": f"{info.socket_binding.unicast_addr[0]}:{info.socket_binding.unicast_addr[1]}",
-                "monotonic_time": info.monotonic_time,
-                "utc_time": info.utc_time.isoformat(),
-            }
-            print(json.dumps(summary, indent=2, sort_keys=True))
+            print(json.dumps(summarize_response(info), indent=2))
 
         advertise_interval: float = self._args.advertise_interval
-        bind_addresses: Optional[List[str]] = self._args.bind_addresses
-        if not bind_addresses is None and len(bind_addresses) == 0:
-            bind_addresses = None
+        bind_addresses: Optional[List[str]] = self._args.bind_addresses or None
         server = AnthemDpServer(advertise_interval=advertise_interval, bind_addresses=bind_addresses)
         server.add_notify_handler(notify_handler)
         if not self._provide_traceback:
@@ -116,31 +148,57 @@ class CommandHandler:
     async def cmd_search(self) -> int:
         response_wait_time: float = self._args.wait_time
         max_responses: int = self._args.max_responses
-        bind_addresses: Optional[List[str]] = self._args.bind_addresses
-        if not bind_addresses is None and len(bind_addresses) == 0:
-            bind_addresses = None
-        async with AnthemDpClient(response_wait_time=response_wait_time, bind_addresses=bind_addresses) as client:
-            async with AnthemDpSearchRequest(
-                    client,
-                    response_wait_time=response_wait_time,
-                    max_responses=max_responses,
-                ) as search_request:
-                async for info in search_request.iter_responses():
-                    datagram = info.datagram
-                    summary: JsonableDict = {
-                        "dp_version": datagram.dp_version,
-                        "is_off": datagram.is_off,
-                        "tcp_port": datagram.tcp_port,
-                        "device_name": datagram.device_name,
-                        "model_name": datagram.model_name,
-                        "serial_number": datagram.serial_number,
-                        "src_addr": f"{info.src_addr[0]}:{info.src_addr[1]}",
-                        "local_addr": f"{info.socket_binding.unicast_addr[0]}:{info.socket_binding.unicast_addr[1]}",
-                        "monotonic_time": info.monotonic_time,
-                        "utc_time": info.utc_time.isoformat(),
-                    }
-                    print(json.dumps(summary, indent=2, sort_keys=True))
-                    sys.stdout.flush()
+        bind_addresses: Optional[List[str]] = self._args.bind_addresses or None
+        loop = asyncio.get_running_loop()
+        # Text is written through sys.stdout itself (not its binary buffer), so this works with any
+        # text stream (e.g., redirect_stdout(StringIO())) and newlines are translated as with print()
+        out = sys.stdout
+        flush_handle: Optional[asyncio.TimerHandle] = None
+        finishing = False
+        # JSON encoding, writing and flushing are all done on a single worker thread so that the event loop
+        # is free to keep receiving responses, and sys.stdout is only used by one thread at a time
+        encoder = ThreadPoolExecutor(max_workers=1)
+        pending: deque[asyncio.Future[None]] = deque()
+
+        def emit(summary: JsonableDict) -> None:
+            out.write(json.dumps(summary, indent=2) + '\n')
+
+        def flush_output() -> None:
+            nonlocal flush_handle
+            flush_handle = None
+            # Flushed on the worker thread, since sys.stdout must not be flushed while it is being written
+            pending.append(loop.run_in_executor(encoder, out.flush))
+
+        def on_written(_: asyncio.Future[None]) -> None:
+            nonlocal flush_handle
+            # Coalesce flushes so that a burst of responses is written to stdout at once. The delay
+            # starts when a write has landed, so a slow write is never left waiting for a later flush.
+            if flush_handle is None and not finishing:
+                flush_handle = loop.call_later(SEARCH_OUTPUT_FLUSH_DELAY, flush_output)
+
+        try:
+            async with AnthemDpClient(response_wait_time=response_wait_time, bind_addresses=bind_addresses) as client:
+                async with AnthemDpSearchRequest(
+                        client,
+                        response_wait_time=response_wait_time,
+                        max_responses=max_responses,
+                    ) as search_request:
+                    async for info in search_request.iter_responses():
+                        written = loop.run_in_executor(encoder, emit, summarize_response(info))
+                        written.add_done_callback(on_written)
+                        pending.append(written)
+                        if len(pending) > MAX_PENDING_SEARCH_OUTPUT:
+                            await pending.popleft()
+        finally:
+            # Everything still pending is flushed below, once the worker is idle
+            finishing = True
+            if flush_handle is not None:
+                flush_handle.cancel()
+            try:
+                await asyncio.gather(*pending)
+            finally:
+                encoder.shutdown(wait=True)
+                out.flush()
 
         return 0
 
@@ -240,7 +298,9 @@ class CommandHandler:
         return rc
 
     def run(self) -> int:
-        loop = asyncio.new_event_loop()
+        # uvloop, if it is installed (e.g., with the "uvloop" extra), has much lower per-datagram overhead
+        # than the default asyncio event loop
+        loop = uvloop.new_event_loop() if HAVE_UVLOOP else asyncio.new_event_loop()
         try:
             asyncio.set_event_loop(loop)
             rc = loop.run_until_complete(self.arun())
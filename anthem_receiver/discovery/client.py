@@ -16,6 +16,7 @@ from __future__ import annotations
 
 import asyncio
 from asyncio import Future
+import logging
 import socket
 import sys
 import re
@@ -29,7 +30,11 @@ from .constants import ANTHEM_DP_MULTICAST_ADDRESS, ANTHEM_DP_PORT
 
 from .dp_datagram import AnthemDpDatagram
 from .dp_socket import AnthemDpSocket, AnthemDpSocketBinding, AnthemDpDatagramSubscriber
-from .util import get_local_ip_addresses, CaseInsensitiveDict
+from .util import (
+    get_local_ip_addresses,
+    resolve_multicast_address,
+    SUPPORTS_SO_REUSEPORT,
+  )
 
 ANTHEM_DP_DEFAULT_RESPONSE_WAIT_TIME = 4.0
 """The default amount of time (in seconds) to wait for responses to come in."""
@@ -50,9 +55,9 @@ class AnthemDpResponseInfo:
        value is useful for calculating the age of the advertisement and expiring
        after Max-Age seconds."""
 
-    utc_time: datetime.datetime
-    """The UTC time at which the advertisement was received, as returned by
-        datetime.datetime.utcnow()."""
+    utc_epoch: float
+    """The UTC time at which the advertisement was received, in seconds since the epoch,
+       as returned by time.time()."""
 
     def __init__(
             self,
@@ -64,7 +69,13 @@ class AnthemDpResponseInfo:
         self.src_addr = src_addr
         self.datagram = datagram
         self.monotonic_time = time.monotonic()
-        self.utc_time = datetime.datetime.utcnow()
+        self.utc_epoch = time.time()
+
+    @property
+    def utc_time(self) -> datetime.datetime:
+        """The UTC time at which the advertisement was received, as a naive datetime
+           (the same form returned by datetime.datetime.utcnow()). Computed on demand from utc_epoch."""
+        return datetime.datetime.fromtimestamp(self.utc_epoch, datetime.timezone.utc).replace(tzinfo=None)
 
     def __str__(self) -> str:
         return f"AnthemDpResponse(addr={self.src_addr}, {self.datagram})"
@@ -114,15 +125,15 @@ class AnthemDpSearchRequest(
 
     async def __aenter__(self) -> AnthemDpSearchRequest:
         # It is important that we start the subscriber before we send the search request so that we don't miss any responses.
-        await self.dg_subscriber.__aenter__()
+        # Subscribing directly is equivalent to dg_subscriber.__aenter__(); it is unsubscribed by dg_subscriber.__aexit__().
+        await self.dp_client.add_subscriber(self.dg_subscriber)
         try:
-            for socket_binding in self.dp_client.socket_bindings:
-                search_datagram = AnthemDpDatagram.new_query()
-                socket_binding.sendto(search_datagram, (self.dp_client.multicast_address, self.dp_client.multicast_port))
+            search_datagram = AnthemDpDatagram.new_query()
+            self.dp_client.send_to_all_bindings(search_datagram, (self.dp_client.multicast_address, self.dp_client.multicast_port))
             self.end_time = time.monotonic() + self.response_wait_time
         except BaseException as e:
-            # A call to __aenter__ that raises an exception will not be paired with a call to __aexit__; since we successfully called __aenter__
-            # on the dg_subscriber, we need to call __aexit__ on it to ensure that it is cleaned up properly.
+            # A call to __aenter__ that raises an exception will not be paired with a call to __aexit__; since we successfully
+            # subscribed dg_subscriber, we need to call __aexit__ on it to ensure that it is cleaned up properly.
             await self.dg_subscriber.__aexit__(type(e), e, e.__traceback__)
             raise
         return self
@@ -150,9 +161,10 @@ class AnthemDpSearchRequest(
             if resp_tuple is None:
                 break
             socket_binding, addr, datagram = resp_tuple
-            if not datagram.announce_request and datagram.device_name != '':
+            if datagram.is_advertisement:
                 info = AnthemDpResponseInfo(socket_binding, addr, datagram)
-                logger.debug(f"Received AnthemDp response from {addr} on {socket_binding}: {datagram}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"Received AnthemDp response from {addr} on {socket_binding}: {datagram}")
                 n += 1
                 yield info
 
@@ -199,9 +211,7 @@ class AnthemDpClient(AnthemDpSocket, AsyncContextManager['AnthemDpClient']):
         self.multicast_address = multicast_address
         self.multicast_port = multicast_port
         self.include_loopback = include_loopback
-        if bind_addresses is None:
-            bind_addresses = [ '' ]
-        self.bind_addresses = list(bind_addresses)
+        self.bind_addresses = [ '' ] if not bind_addresses else list(bind_addresses)
 
     #@override
     async def add_socket_bindings(self) -> None:
@@ -210,17 +220,14 @@ class AnthemDpClient(AnthemDpSocket, AsyncContextManager['AnthemDpClient']):
            Must be overridden by subclasses."""
 
         # Create a socket for each bind address
-        addrinfo = socket.getaddrinfo(self.multicast_address, self.multicast_port)[0]
-        address_family = addrinfo[0]
-        assert address_family in (socket.AF_INET, socket.AF_INET6)
+        address_family, group_bin = resolve_multicast_address(self.multicast_address, self.multicast_port)
         is_ipv6 = address_family == socket.AF_INET6
-        group_bin = socket.inet_pton(address_family, addrinfo[4][0])
         logger.debug(f"Creating socket bindings to {self.bind_addresses}")
         for bind_address in self.bind_addresses:
             sock = socket.socket(address_family, socket.SOCK_DGRAM)
             sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-            if sys.platform not in ( 'win32', 'cygwin' ):
+            if SUPPORTS_SO_REUSEPORT:
                 sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             sock.bind((bind_address, self.multicast_port))
             socket_binding = AnthemDpSocketBinding(sock, unicast_addr=sock.getsockname())
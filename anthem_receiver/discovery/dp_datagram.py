@@ -56,6 +56,40 @@ from ..pkg_logging import logger
 from .constants import ANTHEM_DP_PORT
 
 import json
+import struct
+
+_U32 = struct.Struct('>I')
+"""Codec for the 4-byte network-byte-order integer fields"""
+
+_U32_MAX = 0xFFFFFFFF
+"""The largest value that fits in a 4-byte integer field"""
+
+_DATAGRAM_STRUCT = struct.Struct('>6sBBII16s16s16s')
+"""Codec for an entire datagram"""
+
+_NAME_STRUCT = struct.Struct('16s')
+"""Codec for the 16-byte name fields. Pads with NUL bytes up to the field width."""
+
+def _decode_name(raw: bytes) -> str:
+    """Decode a blank-or-null-padded name field"""
+    return raw.rstrip(b'\x00').rstrip().decode('utf-8')
+
+def _decode_flag(raw: bytes) -> bool:
+    """Decode a 1-byte boolean field"""
+    return raw[0] != 0
+
+def _check_u32(name: str, value: int) -> int:
+    """Returns value if it fits in a 4-byte integer field; raises OverflowError (as int.to_bytes would) otherwise.
+       Used before packing, since a failed pack_into would leave the field zeroed."""
+    if not 0 <= value <= _U32_MAX:
+        raise OverflowError(f"{name} must be between 0 and {_U32_MAX}: {value}")
+    return value
+
+def _decode_u32(raw: bytes) -> int:
+    """Decode a 4-byte network-byte-order integer field"""
+    return _U32.unpack(raw)[0]
+
+_FieldValue = TypeVar('_FieldValue')
 
 HeaderValue = Union[str, int, float]
 NullableHeaderValue = Optional[HeaderValue]
@@ -101,8 +135,50 @@ class AnthemDpDatagram():
             On query, this is b'\0'*16.
     """
 
-    _raw_data: bytes
-    """The raw UDP datagram contents"""
+    __slots__ = (
+        '_raw_data',
+        '_view',
+        '_announce_request',
+        '_is_off',
+        '_dp_version',
+        '_tcp_port',
+        '_device_name',
+        '_model_name',
+        '_serial_number',
+      )
+
+    _raw_data: Union[bytes, bytearray]
+    """The raw UDP datagram contents. Immutable bytes may be shared with copies of this datagram;
+       they are replaced with a private bytearray the first time a field is modified, after
+       which fields are updated in place."""
+
+    _view: Optional[memoryview]
+    """A cached view of _raw_data returned by raw_view, or None if it has not been created since
+       _raw_data was last replaced. It only ever views immutable bytes, never a bytearray."""
+
+    # The decoded fields below are parsed from _raw_data in a single pass whenever it is replaced,
+    # and are kept in sync by the field setters, which write through to _raw_data.
+
+    _announce_request: bool
+    """The decoded "announce_request" field"""
+
+    _is_off: bool
+    """The decoded "is_off" field"""
+
+    _dp_version: int
+    """The decoded "dp_version" field"""
+
+    _tcp_port: int
+    """The decoded "tcp_port" field"""
+
+    _device_name: str
+    """The decoded "device_name" field"""
+
+    _model_name: str
+    """The decoded "model_name" field"""
+
+    _serial_number: str
+    """The decoded "serial_number" field"""
 
     _HEADER_OFFSET = 0
     _HEADER_LENGTH = 6
@@ -133,6 +209,9 @@ class AnthemDpDatagram():
 
     _DEFAULT_DP_VERSION = 1
 
+    _DEFAULT_QUERY_RAW_DATA = _DATAGRAM_STRUCT.pack(_HEADER_VALUE, 1, 0, _DEFAULT_DP_VERSION, 0, b'', b'', b'')
+    """The raw contents of a query datagram with default field values"""
+
     def __init__(
             self,
             *,
@@ -150,26 +229,47 @@ class AnthemDpDatagram():
         if copy_from is not None:
             assert (raw_data is None and announce_request is None and is_off is None and dp_version is None and
                     tcp_port is None and device_name is None and model_name is None and serial_number is None)
-            self._raw_data = copy_from._raw_data
+            self._raw_data = copy_from._shared_raw_data()
+            self._view = None
+            self._announce_request = copy_from._announce_request
+            self._is_off = copy_from._is_off
+            self._dp_version = copy_from._dp_version
+            self._tcp_port = copy_from._tcp_port
+            self._device_name = copy_from._device_name
+            self._model_name = copy_from._model_name
+            self._serial_number = copy_from._serial_number
         elif raw_data is None:
-            self._raw_data = self._HEADER_VALUE + b'\x00' * (self._TOTAL_LENGTH - self._HEADER_LENGTH)
+            # The entire datagram is laid down with a single pack_into
+            new_raw_data = self._raw_data = bytearray(self._TOTAL_LENGTH)
+            self._view = None
             if is_query:
                 assert (is_off is None and tcp_port is None and device_name is None and model_name is None and serial_number is None)
-                self.announce_request = announce_request if announce_request is not None else True
-                self.is_off = False
-                self.dp_version = dp_version if dp_version is not None else self._DEFAULT_DP_VERSION
-                self.tcp_port = 0
-                self.raw_device_name = b'\0' * self._DEVICE_NAME_LENGTH
-                self.raw_model_name = b'\0' * self._MODEL_NAME_LENGTH
-                self.raw_serial_number = b'\0' * self._SERIAL_NUMBER_LENGTH
+                _DATAGRAM_STRUCT.pack_into(
+                    new_raw_data,
+                    0,
+                    self._HEADER_VALUE,
+                    0 if announce_request is not None and not announce_request else 1,
+                    0,
+                    self._DEFAULT_DP_VERSION if dp_version is None else _check_u32("dp_version", dp_version),
+                    0,
+                    b'',
+                    b'',
+                    b'',
+                  )
             else:
-                self.announce_request = announce_request if announce_request is not None else False
-                self.is_off = is_off if is_off is not None else False
-                self.dp_version = dp_version if dp_version is not None else self._DEFAULT_DP_VERSION
-                self.tcp_port = tcp_port if tcp_port is not None else ANTHEM_DP_PORT
-                self.device_name = device_name if device_name is not None else 'AVMSIM'
-                self.model_name = model_name if model_name is not None else 'AVM 60'
-                self.serial_number = serial_number if serial_number is not None else ''
+                _DATAGRAM_STRUCT.pack_into(
+                    new_raw_data,
+                    0,
+                    self._HEADER_VALUE,
+                    1 if announce_request else 0,
+                    1 if is_off else 0,
+                    self._DEFAULT_DP_VERSION if dp_version is None else _check_u32("dp_version", dp_version),
+                    ANTHEM_DP_PORT if tcp_port is None else _check_u32("tcp_port", tcp_port),
+                    self._encode_device_name(device_name if device_name is not None else 'AVMSIM'),
+                    self._encode_model_name(model_name if model_name is not None else 'AVM 60'),
+                    self._encode_serial_number(serial_number if serial_number is not None else ''),
+                  )
+            self._parse_raw_data()
         else:
             assert (copy_from is None and announce_request is None and is_off is None and dp_version is None and
                     tcp_port is None and device_name is None and model_name is None and serial_number is None)
@@ -182,37 +282,117 @@ class AnthemDpDatagram():
             dp_version: Optional[int]=None,
           ) -> AnthemDpDatagram:
         """Create a new query datagram"""
+        if ((announce_request is None or announce_request) and
+                (dp_version is None or dp_version == cls._DEFAULT_DP_VERSION)):
+            return cls._from_buffer(cls._DEFAULT_QUERY_RAW_DATA)
         return cls(is_query=True, announce_request=announce_request, dp_version=dp_version)
 
     @classmethod
     def from_raw(cls, raw_data: bytes) -> AnthemDpDatagram:
         """Create a new AnthemDpDatagram from raw bytes"""
-        return cls(raw_data=raw_data)
+        if not (isinstance(raw_data, bytes) and len(raw_data) == cls._TOTAL_LENGTH and
+                raw_data.startswith(cls._HEADER_VALUE)):
+            raise cls._invalid_raw_data_error(raw_data)
+        return cls._from_buffer(raw_data)
+
+    @classmethod
+    def _invalid_raw_data_error(cls, raw_data: object) -> ValueError:
+        """Returns an exception describing why raw_data is not a valid datagram"""
+        if not isinstance(raw_data, bytes):
+            return ValueError("raw_data must be a bytes object")
+        if len(raw_data) != cls._TOTAL_LENGTH:
+            return ValueError(f"raw_data must be exactly {cls._TOTAL_LENGTH} bytes long")
+        return ValueError(f"raw_data must start with {cls._HEADER_VALUE!r}")
+
+    @classmethod
+    def _from_buffer(cls, buffer: Union[bytes, bytearray]) -> AnthemDpDatagram:
+        """Create a new AnthemDpDatagram from an already validated buffer, without going through __init__.
+           A bytearray becomes owned by the new datagram; bytes are shared."""
+        result = cls.__new__(cls)
+        result._raw_data = buffer
+        result._view = None
+        result._parse_raw_data()
+        return result
+
+    def _parse_raw_data(self) -> None:
+        """Decode all fields from _raw_data"""
+        (
+            _,
+            announce_request,
+            is_off,
+            self._dp_version,
+            self._tcp_port,
+            raw_device_name,
+            raw_model_name,
+            raw_serial_number,
+        ) = _DATAGRAM_STRUCT.unpack_from(self._raw_data)
+        self._announce_request = announce_request != 0
+        self._is_off = is_off != 0
+        self._device_name = _decode_name(raw_device_name)
+        self._model_name = _decode_name(raw_model_name)
+        self._serial_number = _decode_name(raw_serial_number)
 
     @property
     def raw_data(self) -> bytes:
         """The raw UDP datagram contents"""
-        return self._raw_data
+        return self._shared_raw_data()
 
     @raw_data.setter
     def raw_data(self, value: bytes) -> None:
         """Set the raw UDP datagram contents, and recompute headers."""
-        if not isinstance(value, bytes):
-            raise ValueError("raw_data must be a bytes object")
-        if len(value) != self._TOTAL_LENGTH:
-            raise ValueError(f"raw_data must be exactly {self._TOTAL_LENGTH} bytes long")
-        if value[self._HEADER_OFFSET:self._HEADER_OFFSET+self._HEADER_LENGTH] != self._HEADER_VALUE:
-            raise ValueError(f"raw_data must start with {self._HEADER_VALUE!r}")
-        assert isinstance(value, bytes)
+        if not (isinstance(value, bytes) and len(value) == self._TOTAL_LENGTH and
+                value.startswith(self._HEADER_VALUE)):
+            raise self._invalid_raw_data_error(value)
         self._raw_data = value
+        self._view = None
+        self._parse_raw_data()
+
+    @property
+    def raw_view(self) -> memoryview:
+        """A read-only view of the raw UDP datagram contents, suitable for passing to
+           sendto() without copying. The view is over immutable bytes: modifying this datagram
+           afterwards copies its contents to a new buffer, so the view (and anything a transport
+           is still holding) keeps the contents as they were when the view was obtained."""
+        view = self._view
+        if view is None:
+            view = self._view = memoryview(self._shared_raw_data())
+        return view
+
+    def _shared_raw_data(self) -> bytes:
+        """Returns the raw datagram contents as immutable bytes that may be shared with other datagrams"""
+        raw_data = self._raw_data
+        if not isinstance(raw_data, bytes):
+            raw_data = self._raw_data = bytes(raw_data)
+        return raw_data
+
+    def _mutable_raw_data(self) -> bytearray:
+        """Returns the raw datagram contents as a bytearray owned by this datagram, first copying them
+           if they are shared"""
+        raw_data = self._raw_data
+        if not isinstance(raw_data, bytearray):
+            raw_data = self._raw_data = bytearray(raw_data)
+            self._view = None
+        return raw_data
 
     def _get_raw_field(self, offset: int, length: int) -> bytes:
-        return self._raw_data[offset:offset+length]
+        # _raw_data may be a bytearray after the datagram has been modified
+        return bytes(self._raw_data[offset:offset+length])
 
-    def _set_raw_field(self, offset: int, length: int, value: bytes) -> None:
+    def _set_raw_field(
+            self,
+            offset: int,
+            length: int,
+            value: bytes,
+            decode: Callable[[bytes], _FieldValue],
+          ) -> _FieldValue:
+        """Replaces the raw contents of a field and returns the decoded value, which the caller
+           stores in its cached field. The new contents are decoded before the buffer is modified,
+           so an invalid value leaves the datagram unchanged."""
         if len(value) != length:
-            raise ValueError(f"Field at offset {offset }must be exactly {length} bytes long: {value!r}")
-        self._raw_data = self._raw_data[:offset] + value + self._raw_data[offset+length:]
+            raise ValueError(f"Field at offset {offset} must be exactly {length} bytes long: {value!r}")
+        decoded = decode(value)
+        self._mutable_raw_data()[offset:offset+length] = value
+        return decoded
 
     @property
     def raw_announce_request(self) -> bytes:
@@ -222,7 +402,7 @@ class AnthemDpDatagram():
     @raw_announce_request.setter
     def raw_announce_request(self, value: bytes) -> None:
         """Set the raw "announce_request" field contents"""
-        self._set_raw_field(self._ANNOUNCE_REQUEST_OFFSET, self._ANNOUNCE_REQUEST_LENGTH, value)
+        self._announce_request = self._set_raw_field(self._ANNOUNCE_REQUEST_OFFSET, self._ANNOUNCE_REQUEST_LENGTH, value, _decode_flag)
 
     @property
     def raw_is_off(self) -> bytes:
@@ -232,7 +412,7 @@ class AnthemDpDatagram():
     @raw_is_off.setter
     def raw_is_off(self, value: bytes) -> None:
         """Set the raw "is_off" field contents"""
-        self._set_raw_field(self._IS_OFF_OFFSET, self._IS_OFF_LENGTH, value)
+        self._is_off = self._set_raw_field(self._IS_OFF_OFFSET, self._IS_OFF_LENGTH, value, _decode_flag)
 
     @property
     def raw_dp_version(self) -> bytes:
@@ -242,7 +422,7 @@ class AnthemDpDatagram():
     @raw_dp_version.setter
     def raw_dp_version(self, value: bytes) -> None:
         """Set the raw "dp_version" field contents"""
-        self._set_raw_field(self._DP_VERSION_OFFSET, self._DP_VERSION_LENGTH, value)
+        self._dp_version = self._set_raw_field(self._DP_VERSION_OFFSET, self._DP_VERSION_LENGTH, value, _decode_u32)
 
     @property
     def raw_tcp_port(self) -> bytes:
@@ -252,7 +432,7 @@ class AnthemDpDatagram():
     @raw_tcp_port.setter
     def raw_tcp_port(self, value: bytes) -> None:
         """Set the raw "tcp_port" field contents"""
-        self._set_raw_field(self._TCP_PORT_OFFSET, self._TCP_PORT_LENGTH, value)
+        self._tcp_port = self._set_raw_field(self._TCP_PORT_OFFSET, self._TCP_PORT_LENGTH, value, _decode_u32)
 
     @property
     def raw_device_name(self) -> bytes:
@@ -262,7 +442,7 @@ class AnthemDpDatagram():
     @raw_device_name.setter
     def raw_device_name(self, value: bytes) -> None:
         """Set the raw "device_name" field contents"""
-        self._set_raw_field(self._DEVICE_NAME_OFFSET, self._DEVICE_NAME_LENGTH, value)
+        self._device_name = self._set_raw_field(self._DEVICE_NAME_OFFSET, self._DEVICE_NAME_LENGTH, value, _decode_name)
 
     @property
     def raw_model_name(self) -> bytes:
@@ -272,7 +452,7 @@ class AnthemDpDatagram():
     @raw_model_name.setter
     def raw_model_name(self, value: bytes) -> None:
         """Set the raw "model_name" field contents"""
-        self._set_raw_field(self._MODEL_NAME_OFFSET, self._MODEL_NAME_LENGTH, value)
+        self._model_name = self._set_raw_field(self._MODEL_NAME_OFFSET, self._MODEL_NAME_LENGTH, value, _decode_name)
 
     @property
     def raw_serial_number(self) -> bytes:
@@ -282,17 +462,18 @@ class AnthemDpDatagram():
     @raw_serial_number.setter
     def raw_serial_number(self, value: bytes) -> None:
         """Set the raw "serial_number" field contents"""
-        self._set_raw_field(self._SERIAL_NUMBER_OFFSET, self._SERIAL_NUMBER_LENGTH, value)
+        self._serial_number = self._set_raw_field(self._SERIAL_NUMBER_OFFSET, self._SERIAL_NUMBER_LENGTH, value, _decode_name)
 
     @property
     def announce_request(self) -> bool:
         """The "announce_request" field contents as a bool"""
-        return self.raw_announce_request != b'\x00'
+        return self._announce_request
 
     @announce_request.setter
     def announce_request(self, value: bool) -> None:
         """Set the "announce_request" field contents from a bool"""
-        self.raw_announce_request = b'\x01' if value else b'\x00'
+        self._mutable_raw_data()[self._ANNOUNCE_REQUEST_OFFSET] = 1 if value else 0
+        self._announce_request = bool(value)
 
     @property
     def header(self) -> bytes:
@@ -302,83 +483,119 @@ class AnthemDpDatagram():
     @property
     def is_off(self) -> bool:
         """The "is_off" field contents as a bool"""
-        return self.raw_is_off != b'\x00'
+        return self._is_off
 
     @is_off.setter
     def is_off(self, value: bool) -> None:
         """Set the "is_off" field contents from a bool"""
-        self.raw_is_off = b'\x01' if value else b'\x00'
+        self._mutable_raw_data()[self._IS_OFF_OFFSET] = 1 if value else 0
+        self._is_off = bool(value)
 
     @property
     def dp_version(self) -> int:
         """The "dp_version" field contents as an int"""
-        return int.from_bytes(self.raw_dp_version, 'big')
+        return self._dp_version
 
     @dp_version.setter
     def dp_version(self, value: int) -> None:
         """Set the "dp_version" field contents from an int"""
-        self.raw_dp_version = value.to_bytes(self._DP_VERSION_LENGTH, 'big')
+        _U32.pack_into(self._mutable_raw_data(), self._DP_VERSION_OFFSET, _check_u32("dp_version", value))
+        self._dp_version = value
 
     @property
     def tcp_port(self) -> int:
         """The "tcp_port" field contents as an int"""
-        return int.from_bytes(self.raw_tcp_port, 'big')
+        return self._tcp_port
 
     @tcp_port.setter
     def tcp_port(self, value: int) -> None:
         """Set the "tcp_port" field contents from an int"""
-        self.raw_tcp_port = value.to_bytes(self._TCP_PORT_LENGTH, 'big')
+        _U32.pack_into(self._mutable_raw_data(), self._TCP_PORT_OFFSET, _check_u32("tcp_port", value))
+        self._tcp_port = value
 
     @property
     def device_name(self) -> str:
         """The "device_name" field contents as a str"""
-        return self.raw_device_name.decode('utf-8').rstrip('\x00').rstrip()
+        return self._device_name
 
     @device_name.setter
     def device_name(self, value: str) -> None:
         """Set the "device_name" field contents from a str"""
-        new_raw = value.rstrip().encode('utf-8').ljust(self._DEVICE_NAME_LENGTH, b' ')
-        if len(new_raw) > self._DEVICE_NAME_LENGTH:
-            raise ValueError(f"device_name must be no more than {self._DEVICE_NAME_LENGTH} encoded bytes long")
-        assert len(new_raw) == self._DEVICE_NAME_LENGTH
-        self.raw_device_name = new_raw
+        new_raw = self._encode_device_name(value)
+        _NAME_STRUCT.pack_into(self._mutable_raw_data(), self._DEVICE_NAME_OFFSET, new_raw)
+        self._device_name = _decode_name(new_raw)
+
+    @classmethod
+    def _encode_device_name(cls, value: str) -> bytes:
+        """Encode a "device_name" str as raw field contents, before NUL-padding to the field width"""
+        new_raw = value.encode('utf-8').rstrip().ljust(cls._DEVICE_NAME_LENGTH, b' ')
+        if len(new_raw) > cls._DEVICE_NAME_LENGTH:
+            raise ValueError(f"device_name must be no more than {cls._DEVICE_NAME_LENGTH} encoded bytes long")
+        return new_raw
+
+    @property
+    def is_advertisement(self) -> bool:
+        """True if this is an advertisement or query response; i.e., it is not an announce
+           request, and it has a device name"""
+        return not self._announce_request and self._device_name != ''
 
     @property
     def model_name(self) -> str:
         """The "model_name" field contents as a str"""
-        return self.raw_model_name.decode('utf-8').rstrip('\x00').rstrip()
+        return self._model_name
 
     @model_name.setter
     def model_name(self, value: str) -> None:
         """Set the "model_name" field contents from a str"""
-        # to be consistent with the AVM-60, we will blank-pad to 7 characters, and
-        # then null-pad the rest
-        new_raw = value.rstrip().encode('utf-8').ljust(7, b' ').ljust(self._MODEL_NAME_LENGTH, b'\x00')
-        if len(new_raw) > self._MODEL_NAME_LENGTH:
-            raise ValueError(f"model_name must be no more than {self._MODEL_NAME_LENGTH} encoded bytes long")
-        assert len(new_raw) == self._MODEL_NAME_LENGTH
-        self.raw_model_name = new_raw
+        new_raw = self._encode_model_name(value)
+        _NAME_STRUCT.pack_into(self._mutable_raw_data(), self._MODEL_NAME_OFFSET, new_raw)
+        self._model_name = _decode_name(new_raw)
+
+    @classmethod
+    def _encode_model_name(cls, value: str) -> bytes:
+        """Encode a "model_name" str as raw field contents, before NUL-padding to the field width"""
+        # to be consistent with the AVM-60, we will blank-pad to 7 characters; the
+        # rest is null-padded when the field is packed
+        new_raw = value.encode('utf-8').rstrip().ljust(7, b' ')
+        if len(new_raw) > cls._MODEL_NAME_LENGTH:
+            raise ValueError(f"model_name must be no more than {cls._MODEL_NAME_LENGTH} encoded bytes long")
+        return new_raw
 
     @property
     def serial_number(self) -> str:
         """The "serial_number" field contents as a str"""
-        return self.raw_serial_number.decode('utf-8').rstrip('\x00').rstrip()
+        return self._serial_number
 
     @serial_number.setter
     def serial_number(self, value: str) -> None:
         """Set the "serial_number" field contents from a str"""
-        new_raw = value.rstrip().encode('utf-8').ljust(self._SERIAL_NUMBER_LENGTH, b'\x00')
-        if len(new_raw) > self._SERIAL_NUMBER_LENGTH:
-            raise ValueError(f"serial_number must be no more than {self._SERIAL_NUMBER_LENGTH} encoded bytes long")
-        assert len(new_raw) == self._SERIAL_NUMBER_LENGTH
-        self.raw_serial_number = new_raw
+        new_raw = self._encode_serial_number(value)
+        _NAME_STRUCT.pack_into(self._mutable_raw_data(), self._SERIAL_NUMBER_OFFSET, new_raw)
+        self._serial_number = _decode_name(new_raw)
+
+    @classmethod
+    def _encode_serial_number(cls, value: str) -> bytes:
+        """Encode a "serial_number" str as raw field contents, before NUL-padding to the field width"""
+        new_raw = value.encode('utf-8').rstrip()
+        if len(new_raw) > cls._SERIAL_NUMBER_LENGTH:
+            raise ValueError(f"serial_number must be no more than {cls._SERIAL_NUMBER_LENGTH} encoded bytes long")
+        return new_raw
 
     def copy(self) -> AnthemDpDatagram:
         """Return a copy of this object"""
         return AnthemDpDatagram(copy_from=self)
 
     def __str__(self) -> str:
-        return f"AnthemDpDatagram([{self.raw_data.hex(' ')}], announce={self.announce_request}, is_off={self.is_off}, dp_version={self.dp_version}, tcp_port={self.tcp_port}, device_name={self.device_name!r}, model_name={self.model_name!r}, serial_number={self.serial_number!r})"
+        return "AnthemDpDatagram([%s], announce=%s, is_off=%s, dp_version=%d, tcp_port=%d, device_name=%r, model_name=%r, serial_number=%r)" % (
+            self._raw_data.hex(' '),
+            self.announce_request,
+            self.is_off,
+            self.dp_version,
+            self.tcp_port,
+            self.device_name,
+            self.model_name,
+            self.serial_number,
+          )
 
     def __repr__(self) -> str:
         return str(self)
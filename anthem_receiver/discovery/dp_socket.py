@@ -23,6 +23,9 @@ from __future__ import annotations
 
 import asyncio
 from asyncio import Future
+from collections import deque
+import functools
+import logging
 import socket
 from abc import ABC, abstractmethod
 
@@ -33,6 +36,9 @@ from .dp_datagram import AnthemDpDatagram
 
 MAX_QUEUE_SIZE = 1000
 
+SOCKET_RECEIVE_BUFFER_SIZE = 2 * 1024 * 1024
+"""The requested kernel receive buffer size for bound datagram sockets. The kernel may silently cap this."""
+
 class AnthemDpSocketBinding:
     """
     An encapsulation of the binding of an AnthemDpSocket to a single low-level
@@ -44,21 +50,31 @@ class AnthemDpSocketBinding:
     loop.create_datagram_endpoint.
     """
 
-    dp_socket: Optional[AnthemDpSocket] = None
+    __slots__ = (
+        'dp_socket',
+        'index',
+        'sock',
+        '_protocol',
+        '_transport',
+        'unicast_addr',
+        'sockname',
+      )
+
+    dp_socket: Optional[AnthemDpSocket]
     """The AnthemDpSocket that is bound to this low-level socket. """
 
-    index: int = -1
+    index: int
     """The index of this socket binding within AnthemDpSocket. Set to -1 until this socket binding is added."""
 
-    sock: Optional[socket.socket] = None
+    sock: Optional[socket.socket]
     """The low-level socket that is bound to this AnthemDpSocket."""
 
-    _protocol: Optional[_AnthemDpSocketProtocol] = None
+    _protocol: Optional[_AnthemDpSocketProtocol]
     """The adapter between the asyncio transport and this AnthemDpSocket.
        This is set when the _AnthemDpSocketProtocol instance is created by
        loop.create_datagram_endpoint()."""
 
-    _transport: Optional[asyncio.DatagramTransport] = None
+    _transport: Optional[asyncio.DatagramTransport]
     """The asyncio transport that is bound to this AnthemDpSocket. This is set
        either when _AnthemDpSocketProtocol.connection_made() is called, or
        when the transport is returned to AnthemDpSocket by
@@ -77,18 +93,28 @@ class AnthemDpSocketBinding:
             sock: socket.socket,
             unicast_addr: Optional[HostAndPort]=None,
             sockname: Optional[str]=None):
+        self.dp_socket = None
+        self.index = -1
         self.sock = sock
+        self._protocol = None
+        self._transport = None
+        # A larger kernel buffer lets bursts of datagrams survive short stalls of the event loop
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_RECEIVE_BUFFER_SIZE)
+        except OSError as e:
+            logger.debug(f"Unable to set SO_RCVBUF on {sock}: {e}")
+        bound_addr = sock.getsockname()
         if unicast_addr is None:
-            unicast_addr = sock.getsockname()
-            assert isinstance(unicast_addr, tuple)
+            unicast_addr = bound_addr
         self.unicast_addr = unicast_addr
         if sockname is None:
-            bound_addr = sock.getsockname()
             if bound_addr == unicast_addr:
                 sockname = str(bound_addr)
             else:
                 sockname = f"{bound_addr}@{unicast_addr}"
         self.sockname = sockname
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Receive buffer size for {sockname}: {sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)}")
 
     async def attach_to_dp_socket(self, dp_socket: AnthemDpSocket, index: int) -> None:
         if self.index >= 0:
@@ -118,9 +144,10 @@ class AnthemDpSocketBinding:
         self._protocol = protocol
 
     def sendto(self, datagram: AnthemDpDatagram, addr: HostAndPort) -> None:
-        logger.debug(f"Sending AnthemDpDatagram via {self} to {addr}: {datagram}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Sending AnthemDpDatagram via {self} to {addr}: {datagram}")
         assert not self.transport is None
-        self.transport.sendto(datagram.raw_data, addr)
+        self.transport.sendto(datagram.raw_view, addr)
 
     def __str__(self) -> str:
         return f"AnthemDpSocketBinding({self.index}: {self.sockname})"
@@ -132,6 +159,8 @@ class _AnthemDpSocketProtocol(asyncio.DatagramProtocol, ABC):
     """An adapter between the asyncio transport and AnthemDpSocket. There is one instance of this class
        created for each low-level socket that is created (typically one per network interface).
        """
+    __slots__ = ('socket_binding',)
+
     socket_binding: AnthemDpSocketBinding
 
     def __init__(self, socket_binding: AnthemDpSocketBinding):
@@ -200,15 +229,21 @@ class AnthemDpDatagramSubscriber(
         AsyncIterable[Tuple[AnthemDpSocketBinding, HostAndPort, AnthemDpDatagram]]
       ):
     dp_socket: AnthemDpSocket
-    queue: asyncio.Queue[Optional[Tuple[AnthemDpSocketBinding, HostAndPort, AnthemDpDatagram]]]
+    queue: deque[Tuple[AnthemDpSocketBinding, HostAndPort, AnthemDpDatagram]]
+    """Received datagrams that are waiting to be received. Bounded to max_queue_size entries; when it is
+       full, the oldest datagram is dropped to make room for a new one."""
+    data_event: asyncio.Event
+    """Set when datagrams are added to queue or end of stream is reached, to wake up waiting tasks.
+       A burst of datagrams that arrives while a task is waiting wakes it up only once."""
     final_result: Future[None]
     eos: bool = False
     eos_exc: Optional[Exception] = None
 
     def __init__(self, dp_socket: AnthemDpSocket, max_queue_size: int=MAX_QUEUE_SIZE):
         self.dp_socket = dp_socket
-        self.queue = asyncio.Queue(max_queue_size)
-        self.final_result = Future()
+        self.queue = deque(maxlen=max_queue_size)
+        self.data_event = asyncio.Event()
+        self.final_result = asyncio.get_event_loop().create_future()
 
     async def __aenter__(self) -> AnthemDpDatagramSubscriber:
         await self.dp_socket.add_subscriber(self)
@@ -242,74 +277,62 @@ class AnthemDpDatagramSubscriber(
     def set_final_result(self) -> None:
         if not self.final_result.done():
             self.final_result.set_result(None)
-            if not self.queue is None:
-                # wake up any waiting tasks
-                try:
-                    self.queue.put_nowait(None)
-                except asyncio.QueueFull:
-                    # queue is full so waiters will wake up soon
-                    pass
+            # datagrams that have not been received yet are discarded
+            self.queue.clear()
+            # wake up any waiting tasks
+            self.data_event.set()
             self.eos = True
             self.eos_exc = None
 
     def set_final_exception(self, e: BaseException) -> None:
         if not self.final_result.done():
             self.final_result.set_exception(e)
-            if not self.queue is None:
-                # wake up any waiting tasks
-                try:
-                    self.queue.put_nowait(None)
-                except asyncio.QueueFull:
-                    # queue is full so waiters will wake up soon
-                    pass
+            # datagrams that have not been received yet are discarded
+            self.queue.clear()
+            # wake up any waiting tasks
+            self.data_event.set()
             self.eos = True
             self.eos_exc = None
 
     async def receive(self) -> Optional[Tuple[AnthemDpSocketBinding, HostAndPort, AnthemDpDatagram]]:
-        if self.final_result.done():
-            await self.final_result
-            return None
-        if self.eos and self.queue.empty():
-            if self.eos_exc is None:
-                self.set_final_result()
-            else:
-                self.set_final_exception(self.eos_exc)
-            await self.final_result
-            return None
-        try:
-          result =  await self.queue.get()
-          self.queue.task_done()
-          if result is None:
-              if not self.final_result.done():
-                  assert self.eos
-                  if self.eos_exc is None:
-                      self.set_final_result()
-                  else:
-                      self.set_final_exception(self.eos_exc)
-              await self.final_result
-              return None
-        except BaseException as e:
-            self.set_final_exception(e)
-            raise
-        return result
+        # The queue is emptied when final_result is set, and eos is always set along with
+        # final_result, so a single check of each is enough to cover every state.
+        queue = self.queue
+        while True:
+            if queue:
+                return queue.popleft()
+            if self.eos:
+                if not self.final_result.done():
+                    if self.eos_exc is None:
+                        self.set_final_result()
+                    else:
+                        self.set_final_exception(self.eos_exc)
+                await self.final_result
+                return None
+            try:
+                await self.data_event.wait()
+            except BaseException as e:
+                self.set_final_exception(e)
+                raise
+            self.data_event.clear()
 
     def on_datagram(self, socket_binding: AnthemDpSocketBinding, addr: HostAndPort, datagram: AnthemDpDatagram) -> None:
-        if not self.eos and not self.final_result.done():
-            try:
-                self.queue.put_nowait((socket_binding, addr, datagram))
-            except asyncio.QueueFull:
-                logger.warning(f"Queue full, dropping datagram from {socket_binding} {addr}: {datagram}")
+        if not self.eos:
+            queue = self.queue
+            if len(queue) == queue.maxlen:
+                # The bounded deque discards the oldest entry on append; for discovery, newer datagrams
+                # are more useful than stale ones.
+                old_socket_binding, old_addr, old_datagram = queue[0]
+                logger.warning(f"Queue full, dropping oldest datagram from {old_socket_binding} {old_addr}: {old_datagram}")
+            queue.append((socket_binding, addr, datagram))
+            self.data_event.set()
 
     def on_end_of_stream(self, exc: Optional[Exception]=None) -> None:
-        if not self.eos and not self.final_result.done():
+        if not self.eos:
             self.eos = True
             self.eos_exc = exc
-            try:
-                # wake up any waiting tasks
-                self.queue.put_nowait(None)
-            except asyncio.QueueFull:
-                # queue is full so waiters will wake up soon
-                pass
+            # wake up any waiting tasks
+            self.data_event.set()
 
 class AnthemDpSocket(AsyncContextManager['AnthemDpSocket']):
     """
@@ -329,21 +352,33 @@ class AnthemDpSocket(AsyncContextManager['AnthemDpSocket']):
     socket_bindings: List[AnthemDpSocketBinding]
     """A list of AnthemDpSocketBinding instances, one for each low-level socket that is in use."""
 
+    _single_binding: Optional[AnthemDpSocketBinding] = None
+    """The only socket binding, if exactly one socket binding is in use; otherwise None.
+       Allows the common single-interface case to skip iterating socket_bindings."""
+
     final_result: Future[None]
     """A future that is set when the dp_socket is stopped."""
 
-    datagram_subscribers: Set[AnthemDpDatagramSubscriber] = set()
-    """A set of subscribers that wish to receive AnthemDp Datagrams."""
+    datagram_subscribers: List[AnthemDpDatagramSubscriber]
+    """The subscribers that wish to receive AnthemDp Datagrams, in the order they were added."""
+
+    _subscribers_snapshot: Tuple[AnthemDpDatagramSubscriber, ...] = ()
+    """An immutable snapshot of datagram_subscribers, rebuilt whenever a subscriber is added or removed, so
+       that delivery to subscribers does not need to copy the set for every datagram."""
 
     def __init__(self):
-        self.final_result = Future()
+        self.final_result = asyncio.get_event_loop().create_future()
         self.socket_bindings = []
+        self.datagram_subscribers = []
 
     async def add_subscriber(self, subscriber: AnthemDpDatagramSubscriber) -> None:
-        self.datagram_subscribers.add(subscriber)
+        if subscriber not in self.datagram_subscribers:
+            self.datagram_subscribers.append(subscriber)
+        self._subscribers_snapshot = tuple(self.datagram_subscribers)
 
     async def remove_subscriber(self, subscriber: AnthemDpDatagramSubscriber) -> None:
         self.datagram_subscribers.remove(subscriber)
+        self._subscribers_snapshot = tuple(self.datagram_subscribers)
 
     async def add_socket_binding(self, socket_binding: AnthemDpSocketBinding) -> None:
         if socket_binding.index >= 0:
@@ -372,11 +407,20 @@ class AnthemDpSocket(AsyncContextManager['AnthemDpSocket']):
             if len(self.socket_bindings) == 0:
                 raise AnthemReceiverError("No datagram sockets were added to AnthemDpSocket")
 
-            for socket_binding in self.socket_bindings:
-                untyped_transport, protocol = await loop.create_datagram_endpoint(
-                    lambda: _AnthemDpSocketProtocol(socket_binding),
-                    sock=socket_binding.sock
-                  )
+            # Endpoints for all bindings are created concurrently. Every creation is allowed to finish
+            # before any error is raised, so that all transports that were created are attached to their
+            # bindings and get closed during cleanup.
+            results = await asyncio.gather(
+                *(loop.create_datagram_endpoint(
+                      functools.partial(_AnthemDpSocketProtocol, socket_binding),
+                      sock=socket_binding.sock
+                    ) for socket_binding in self.socket_bindings),
+                return_exceptions=True
+              )
+            for socket_binding, result in zip(self.socket_bindings, results):
+                if isinstance(result, BaseException):
+                    raise result
+                untyped_transport, protocol = result
                 # Note: There is a problem with asyncio datagram transports in that they do not inherit from
                 # asyncio.DatagramTransport.  It is not serious since they implement the same interface, but
                 # it does cause mypy to complain.  The following nonsense is a workaround to make mypy happy.
@@ -387,6 +431,9 @@ class AnthemDpSocket(AsyncContextManager['AnthemDpSocket']):
                 socket_binding.protocol = protocol
                 socket_binding.transport = transport
 
+            if len(self.socket_bindings) == 1:
+                self._single_binding = self.socket_bindings[0]
+
             await self.finish_start()
 
         except BaseException as e:
@@ -416,16 +463,32 @@ class AnthemDpSocket(AsyncContextManager['AnthemDpSocket']):
         await self.stop()
         await self.wait_for_done()
 
+    def send_to_all_bindings(self, datagram: AnthemDpDatagram, addr: HostAndPort) -> None:
+        """Sends a datagram to addr on every socket binding (typically one per network interface).
+
+           The datagram's contents are handed to each transport synchronously, so the same
+           datagram can safely be sent on every binding."""
+        single_binding = self._single_binding
+        if single_binding is not None:
+            single_binding.sendto(datagram, addr)
+        else:
+            for socket_binding in self.socket_bindings:
+                socket_binding.sendto(datagram, addr)
+
     def connection_made(self, socket_binding: AnthemDpSocketBinding) -> None:
         """Called when a connection is made."""
         logger.debug(f"Connection made: {socket_binding}")
 
     def datagram_received(self, socket_binding: AnthemDpSocketBinding, addr: HostAndPort, data: bytes):
         """Called when some datagram is received."""
+        subscribers = self._subscribers_snapshot
+        if not subscribers:
+            # Nobody is listening, so there is no point in decoding the datagram
+            return
         try:
-            datagram = AnthemDpDatagram(raw_data=data)
-            logger.debug(f"Received datagram from {socket_binding} {addr}: {datagram}")
-            subscribers = list(self.datagram_subscribers)
+            datagram = AnthemDpDatagram.from_raw(data)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Received datagram from {socket_binding} {addr}: {datagram}")
             for subscriber in subscribers:
                 try:
                     subscriber.on_datagram(socket_binding, addr, datagram)
@@ -442,8 +505,7 @@ class AnthemDpSocket(AsyncContextManager['AnthemDpSocket']):
         """
         logger.info(f"Error received from transport {socket_binding}: {exc}")
         # TODO: End all socket bindings if any socket fails
-        subscribers = list(self.datagram_subscribers)
-        for subscriber in subscribers:
+        for subscriber in self._subscribers_snapshot:
             try:
                 subscriber.on_end_of_stream(exc)
             except BaseException as e:
@@ -456,8 +518,7 @@ class AnthemDpSocket(AsyncContextManager['AnthemDpSocket']):
         logger.debug(f"Connection to transport lost on {socket_binding}, exc={exc}")
         self.transport = None
         # TODO: End all socket bindings if any socket fails
-        subscribers = list(self.datagram_subscribers)
-        for subscriber in subscribers:
+        for subscriber in self._subscribers_snapshot:
             try:
                 subscriber.on_end_of_stream(exc)
             except BaseException as e:
@@ -467,21 +528,27 @@ class AnthemDpSocket(AsyncContextManager['AnthemDpSocket']):
         else:
             self.set_final_exception(exc)
 
+    # Both of the following are called from stop() and again from set_final_result()/set_final_exception(),
+    # so each binding's reference is cleared before closing, ensuring that a transport or socket is only
+    # ever closed (and any error logged) once.
+
     def _close_all_transports(self) -> None:
         for socket_binding in self.socket_bindings:
-            if not socket_binding.transport is None:
+            transport = socket_binding.transport
+            if not transport is None:
+                socket_binding.transport = None
                 try:
-                    socket_binding.transport.close()
+                    transport.close()
                 except BaseException as e:
                     logger.error(f"Error closing transport on {socket_binding}: {e}")
-                socket_binding.transport = None
 
     def _close_all_socks(self) -> None:
         for socket_binding in self.socket_bindings:
-            if not socket_binding.sock is None:
+            sock = socket_binding.sock
+            if not sock is None:
+                socket_binding.sock = None
                 try:
-                    socket_binding.sock.close()
-                    socket_binding.sock = None
+                    sock.close()
                 except BaseException as e:
                     logger.error(f"Error closing socket on {socket_binding}: {e}")
 
@@ -19,6 +19,8 @@ from __future__ import annotations
 
 import asyncio
 from asyncio import Future
+import heapq
+import logging
 import socket
 import sys
 import re
@@ -31,7 +33,12 @@ from .constants import ANTHEM_DP_MULTICAST_ADDRESS, ANTHEM_DP_PORT
 
 from .dp_datagram import AnthemDpDatagram
 from .dp_socket import AnthemDpSocket, AnthemDpSocketBinding, AnthemDpDatagramSubscriber
-from .util import get_local_ip_addresses
+from .util import (
+    get_local_ip_addresses,
+    resolve_multicast_address,
+    SUPPORTS_SO_REUSEPORT,
+    SUPPORTS_IP_MULTICAST_ALL,
+  )
 
 DEFAULT_MAX_AGE = 1800
 
@@ -54,9 +61,9 @@ class AnthemDpAdvertisementInfo:
        value is useful for calculating the age of the advertisement and expiring
        after Max-Age seconds."""
 
-    utc_time: datetime.datetime
-    """The UTC time at which the advertisement was received, as returned by
-        datetime.datetime.utcnow()."""
+    utc_epoch: float
+    """The UTC time at which the advertisement was received, in seconds since the epoch,
+       as returned by time.time()."""
 
     def __init__(
             self,
@@ -68,7 +75,13 @@ class AnthemDpAdvertisementInfo:
         self.src_addr = src_addr
         self.datagram = datagram
         self.monotonic_time = time.monotonic()
-        self.utc_time = datetime.datetime.utcnow()
+        self.utc_epoch = time.time()
+
+    @property
+    def utc_time(self) -> datetime.datetime:
+        """The UTC time at which the advertisement was received, as a naive datetime
+           (the same form returned by datetime.datetime.utcnow()). Computed on demand from utc_epoch."""
+        return datetime.datetime.fromtimestamp(self.utc_epoch, datetime.timezone.utc).replace(tzinfo=None)
 
 AnthemDpServerNotifyHandler = Callable[[AnthemDpAdvertisementInfo], Awaitable[None]]
 """A callback for received AnthemDp advertisements."""
@@ -103,8 +116,19 @@ class AnthemDpServer(AnthemDpSocket):
     """The task that broadcasts periodic local device advertisements to the multicast address.
        If None, no advertisements will be sent."""
 
-    collected_advertisements: Dict[Tuple[HostAndPort, str], AnthemDpDatagram]
-    """A dictionary of collected advertisements. The key is a tuple of (host, port, advertised_device_name)."""
+    collected_advertisements: Dict[Tuple[HostAndPort, str], AnthemDpAdvertisementInfo]
+    """A dictionary of collected advertisements. The key is a tuple of ((host, port), advertised_device_name).
+       Entries older than max_age are removed lazily; use get_collected_advertisements() to obtain only
+       current entries."""
+
+    max_age: float = DEFAULT_MAX_AGE
+    """The age (in seconds) after which a collected advertisement that has not been refreshed expires."""
+
+    _expiry_heap: List[Tuple[float, Tuple[HostAndPort, str]]]
+    """A min-heap of (expire_monotonic_time, key) for entries in collected_advertisements, so that expired
+       entries can be found without scanning. There is one heap entry per collected key; if the advertisement
+       has been refreshed since the entry was pushed, its expire time is early, and the entry is pushed back
+       with the new expire time when it is popped."""
 
     multicast_address: str = ANTHEM_DP_MULTICAST_ADDRESS
     """The multicast address to listen on and advertise to."""
@@ -139,7 +163,8 @@ class AnthemDpServer(AnthemDpSocket):
             multicast_address: str=ANTHEM_DP_MULTICAST_ADDRESS,
             multicast_port: int=ANTHEM_DP_PORT,
             bind_addresses: Optional[Iterable[str]]=None,
-            include_loopback: bool = False
+            include_loopback: bool = False,
+            max_age: Optional[float]=None,
           ) -> None:
         super().__init__()
         if device_name is None:
@@ -169,10 +194,10 @@ class AnthemDpServer(AnthemDpSocket):
         self.multicast_address = multicast_address
         self.multicast_port = multicast_port
         self.collected_advertisements = {}
+        self.max_age = DEFAULT_MAX_AGE if max_age is None else max_age
+        self._expiry_heap = []
         self.include_loopback = include_loopback
-        if bind_addresses is None:
-            bind_addresses = [ '' ]
-        self.bind_addresses = list(bind_addresses)
+        self.bind_addresses = [ '' ] if not bind_addresses else list(bind_addresses)
         self.notify_handlers = {}
 
     #@override
@@ -182,17 +207,14 @@ class AnthemDpServer(AnthemDpSocket):
            Must be overridden by subclasses."""
 
         # Create a socket for each bind address
-        addrinfo = socket.getaddrinfo(self.multicast_address, self.multicast_port)[0]
-        address_family = addrinfo[0]
-        assert address_family in (socket.AF_INET, socket.AF_INET6)
+        address_family, group_bin = resolve_multicast_address(self.multicast_address, self.multicast_port)
         is_ipv6 = address_family == socket.AF_INET6
-        group_bin = socket.inet_pton(address_family, addrinfo[4][0])
         logger.debug(f"Creating socket bindings to {self.multicast_address}:{self.multicast_port} from {self.bind_addresses}")
         for bind_address in self.bind_addresses:
             sock = socket.socket(address_family, socket.SOCK_DGRAM)
             sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-            if sys.platform not in ( 'win32', 'cygwin' ):
+            if SUPPORTS_SO_REUSEPORT:
                 sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             # On Linux, disabling IP_MULTICAST_ALL ensures that each socket only receives
             # multicast packets sent to the multicast address on the interface that the
@@ -200,7 +222,7 @@ class AnthemDpServer(AnthemDpSocket):
             # bound to 0.0.0.0:<port> even if IP_ADD_MEMBERSHIP for the socket includes a filter for
             # the bind address. If there are multiple bound sockets, This would result in duplicate
             # packets being received by subscribers, with incorrect AnthemDpBoundSocket values.
-            if sys.platform in ('linux', 'linux2'):
+            if SUPPORTS_IP_MULTICAST_ALL:
                 logger.debug(f"Disabling IP_MULTICAST_ALL on socket {bind_address}")
                 sock.setsockopt(socket.IPPROTO_IP, IPV6_MULTICAST_ALL if is_ipv6 else IP_MULTICAST_ALL, 0)
             # Multicast listeners MUST bind to 0.0.0.0:<port> or [::]:<port> to receive multicast packets
@@ -229,6 +251,43 @@ class AnthemDpServer(AnthemDpSocket):
         """Removes a previously added notify handler."""
         del self.notify_handlers[i]
 
+    def get_collected_advertisements(self) -> Dict[Tuple[HostAndPort, str], AnthemDpAdvertisementInfo]:
+        """Returns a snapshot of the collected advertisements that have not expired, keyed by
+           ((host, port), advertised_device_name)."""
+        self._expire_stale()
+        return dict(self.collected_advertisements)
+
+    def _collect_advertisement(self, info: AnthemDpAdvertisementInfo) -> None:
+        """Adds or refreshes a collected advertisement, and expires any that have become stale."""
+        key = (info.src_addr, info.datagram.device_name)
+        collected = self.collected_advertisements
+        is_new = key not in collected
+        collected[key] = info
+        if is_new:
+            # A refreshed entry keeps its existing heap entry, which is pushed back with the new expiry
+            # time when it is popped
+            heapq.heappush(self._expiry_heap, (info.monotonic_time + self.max_age, key))
+        self._expire_stale(info.monotonic_time)
+
+    def _expire_stale(self, now: Optional[float]=None) -> None:
+        """Removes collected advertisements that are older than max_age. Only expired heap entries are
+           visited."""
+        if now is None:
+            now = time.monotonic()
+        heap = self._expiry_heap
+        collected = self.collected_advertisements
+        while len(heap) > 0 and heap[0][0] <= now:
+            _, key = heapq.heappop(heap)
+            info = collected.get(key)
+            if info is None:
+                continue
+            expire_time = info.monotonic_time + self.max_age
+            if expire_time <= now:
+                del collected[key]
+            else:
+                # The advertisement was refreshed since this heap entry was pushed
+                heapq.heappush(heap, (expire_time, key))
+
     async def finish_start(self) -> None:
         """Called after the socket is up and running.  Subclasses can override to do additional
            initialization."""
@@ -240,55 +299,52 @@ class AnthemDpServer(AnthemDpSocket):
     async def wait_for_dependents_done(self) -> None:
         """Called after final_result has been awaited.  Subclasses can override to do additional
            cleanup."""
+        named_tasks = [
+            (name, task) for name, task in (
+                ("collector", self.collector_task),
+                ("advertiser", self.advertiser_task),
+                ("responder", self.responder_task),
+              ) if task is not None
+          ]
+        # Cancel all tasks first, then wait for all of them together
+        for _, task in named_tasks:
+            task.cancel()
         try:
-            if self.collector_task is not None:
-                self.collector_task.cancel()
-                try:
-                    await self.collector_task
-                except BaseException:
-                    pass
-                self.collector_task = None
+            results = await asyncio.gather(*(task for _, task in named_tasks), return_exceptions=True)
         except asyncio.CancelledError:
-            pass
-        except BaseException as e:
-            logger.warning(f"Exception while cancelling collector task: {e}")
-
-        try:
-            if self.advertiser_task is not None:
-                self.advertiser_task.cancel()
-                try:
-                    await self.advertiser_task
-                except BaseException:
-                    pass
-                self.advertiser_task = None
-        except asyncio.CancelledError:
-            pass
-        except BaseException as e:
-            logger.warning(f"Exception while cancelling advertiser task: {e}")
-
-        try:
-            if self.responder_task is not None:
-                self.responder_task.cancel()
-                try:
-                    await self.responder_task
-                except BaseException:
-                    pass
-                self.responder_task = None
-        except asyncio.CancelledError:
-            pass
-        except BaseException as e:
-            logger.warning(f"Exception while cancelling responder task: {e}")
+            return
+        # The task references are kept until the tasks have finished, so that they are not released
+        # while still running if this wait is itself cancelled
+        self.collector_task = None
+        self.advertiser_task = None
+        self.responder_task = None
+        for (name, _), result in zip(named_tasks, results):
+            if isinstance(result, BaseException) and not isinstance(result, asyncio.CancelledError):
+                logger.warning(f"Exception while cancelling {name} task: {result}")
 
     async def _run_collector_task(self) -> None:
         logger.debug("Device collector task starting")
         try:
             async with AnthemDpDatagramSubscriber(self) as subscriber:
                 async for socket_binding, addr, datagram in subscriber.iter_datagrams():
-                    if not datagram.announce_request and datagram.device_name != '':
+                    if datagram.is_advertisement:
                             info = AnthemDpAdvertisementInfo(socket_binding, addr, datagram)
-                            logger.debug(f"Collector received advertisement from {addr} on {socket_binding}: {datagram}")
-                            for handler in self.notify_handlers.values():
-                                await handler(info)
+                            self._collect_advertisement(info)
+                            if logger.isEnabledFor(logging.DEBUG):
+                                logger.debug(f"Collector received advertisement from {addr} on {socket_binding}: {datagram}")
+                            handlers = tuple(self.notify_handlers.values())
+                            if len(handlers) == 1:
+                                # A lone handler is awaited directly, avoiding the creation and scheduling of a task
+                                try:
+                                    await handlers[0](info)
+                                except Exception as e:
+                                    logger.warning(f"Notify handler raised exception processing advertisement {datagram}: {e}")
+                            elif handlers:
+                                # Handlers run concurrently, so a slow handler does not delay the others
+                                results = await asyncio.gather(*(handler(info) for handler in handlers), return_exceptions=True)
+                                for result in results:
+                                    if isinstance(result, BaseException):
+                                        logger.warning(f"Notify handler raised exception processing advertisement {datagram}: {result}")
         except asyncio.CancelledError:
             logger.debug("Device collector task cancelled; exiting")
             raise
@@ -303,12 +359,11 @@ class AnthemDpServer(AnthemDpSocket):
             async with AnthemDpDatagramSubscriber(self) as subscriber:
                 async for socket_binding, addr, datagram in subscriber.iter_datagrams():
                     if datagram.announce_request:
-                        logger.debug(f"AnthemDp responder received query request from {addr} on {socket_binding}: {datagram}")
-                        response = self.advertise_datagram.copy()
+                        if logger.isEnabledFor(logging.DEBUG):
+                            logger.debug(f"AnthemDp responder received query request from {addr} on {socket_binding}: {datagram}")
                         # Anthem discovery protocol requires that responses are sent to the broadcast address
                         # socket_binding.sendto(response, addr)
-                        for socket_binding in self.socket_bindings:
-                            socket_binding.sendto(response, (self.multicast_address, self.multicast_port))
+                        self.send_to_all_bindings(self.advertise_datagram, (self.multicast_address, self.multicast_port))
         except asyncio.CancelledError:
             logger.debug("AnthemDpResponser task cancelled; exiting")
             raise
@@ -322,9 +377,7 @@ class AnthemDpServer(AnthemDpSocket):
         assert self.advertise_interval > 0.0
         try:
             while not self.final_result.done():
-                advertise_datagram = self.advertise_datagram.copy()
-                for socket_binding in self.socket_bindings:
-                    socket_binding.sendto(advertise_datagram, (self.multicast_address, self.multicast_port))
+                self.send_to_all_bindings(self.advertise_datagram, (self.multicast_address, self.multicast_port))
                 try:
                     await asyncio.wait_for(asyncio.shield(self.final_result), timeout=self.advertise_interval)
                 except:
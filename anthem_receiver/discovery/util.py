@@ -13,10 +13,9 @@ from __future__ import annotations
 from typing_extensions import SupportsIndex
 
 import netifaces
+import functools
 import sys
 import socket
-import ipaddress
-from ipaddress import IPv4Address, IPv6Address
 
 from ..internal_types import *
 
@@ -25,6 +24,23 @@ from email.message import Message as EmailParserMessage
 from email.header import Header as EmailParserHeader
 from requests.structures import CaseInsensitiveDict
 
+SUPPORTS_SO_REUSEPORT = sys.platform not in ('win32', 'cygwin')
+"""True if SO_REUSEPORT may be set on sockets on this platform"""
+
+SUPPORTS_IP_MULTICAST_ALL = sys.platform in ('linux', 'linux2')
+"""True if IP_MULTICAST_ALL/IPV6_MULTICAST_ALL may be set on sockets on this platform"""
+
+@functools.lru_cache(maxsize=None)
+def resolve_multicast_address(multicast_address: str, multicast_port: int) -> Tuple[socket.AddressFamily, bytes]:
+    """Returns (address_family: socket.AddressFamily, group_bin: bytes) for a multicast address and port,
+       where group_bin is the packed binary form of the address. Results are cached, since the same
+       (typically fixed) address is resolved, with a blocking call, every time a client or server starts."""
+    addrinfo = socket.getaddrinfo(multicast_address, multicast_port)[0]
+    address_family = addrinfo[0]
+    assert address_family in (socket.AF_INET, socket.AF_INET6)
+    group_bin = socket.inet_pton(address_family, addrinfo[4][0])
+    return address_family, group_bin
+
 def get_local_ip_addresses_and_interfaces(
         address_family: Union[socket.AddressFamily, int]=socket.AF_INET,
         include_loopback: bool=True
@@ -37,7 +53,8 @@ def get_local_ip_addresses_and_interfaces(
            3. IPV4 addresses that begin with 172. follow other IPV4 addresses. This is a hack to
               deprioritize local docker network addresses.
     """
-    result_with_priority: List[Tuple[int, str, str]] = []
+    # One bucket of (ip_address, interface_name) per priority, 0 (most preferred) through 3
+    buckets: List[List[Tuple[str, str]]] = [ [], [], [], [] ]
     assert int(address_family) in (int(socket.AF_INET), int(socket.AF_INET6))
     is_ipv6 = int(address_family) == int(socket.AF_INET6)
     _, default_gateway_ifname = get_default_ip_gateway(address_family)
@@ -50,11 +67,11 @@ def get_local_ip_addresses_and_interfaces(
               assert isinstance(ip_str, str)
               if ifname == default_gateway_ifname:
                   priority = 0
-              elif is_ipv6 and IPv6Address(ip_str).is_loopback:
+              elif is_ipv6 and ip_str.split('%', 1)[0] == '::1':
                   if not include_loopback:
                       continue
                   priority = 3
-              elif not is_ipv6 and IPv4Address(ip_str).is_loopback:
+              elif not is_ipv6 and ip_str.startswith('127.'):
                   if not include_loopback:
                       continue
                   priority = 3
@@ -63,8 +80,13 @@ def get_local_ip_addresses_and_interfaces(
               else:
                   priority = 1
 
-              result_with_priority.append((priority, ip_str, ifname))
-    return [ (ip, ifname) for _, ip, ifname in sorted(result_with_priority)]
+              buckets[priority].append((ip_str, ifname))
+    result: List[Tuple[str, str]] = []
+    for bucket in buckets:
+        # Within a priority, addresses are ordered by (ip_address, interface_name)
+        bucket.sort()
+        result.extend(bucket)
+    return result
 
 def get_local_ip_addresses(address_family: Union[socket.AddressFamily, int]=socket.AF_INET, include_loopback: bool=True) -> List[str]:
     """Returns a List[ip_address: str] for the IP addresses of the local host
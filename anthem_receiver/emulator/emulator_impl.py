@@ -12,6 +12,12 @@ Provides a simple emulation of a Anthem receiver on TCP/IP.
 from __future__ import annotations
 
 import asyncio
+import functools
+import itertools
+import logging
+from collections import deque
+import weakref
+from types import MappingProxyType
 import dp_discovery_protocol as dp
 
 from ..internal_types import *
@@ -33,14 +39,118 @@ from .session import AnthemReceiverEmulatorSession
 
 EMULATOR_WARMUP_TIME = 10.0
 
+EmulatorCommandResult = Union[AnthemResponse, bytes, str, None, bool]
+"""The result of handling a single command. See AnthemReceiverEmulator.handle_command."""
+
+EmulatorCommandHandler = Callable[
+    [AnthemReceiverEmulatorSession, AnthemCommand],
+    Awaitable[EmulatorCommandResult]
+  ]
+"""An async handler for a single named command."""
+
+# Bound reverse lookups from friendly status strings to the response payloads
+# of the corresponding status queries, used by the emulator's status setters.
+_power_status_str_to_payload = name_to_command_meta("power_status.query").response_map.str_to_response_payload
+_input_status_str_to_payload = name_to_command_meta("input_status.query").response_map.str_to_response_payload
+_gamma_table_status_str_to_payload = name_to_command_meta("gamma_table_status.query").response_map.str_to_response_payload
+_gamma_value_status_str_to_payload = name_to_command_meta("gamma_value_status.query").response_map.str_to_response_payload
+_source_status_str_to_payload = name_to_command_meta("source_status.query").response_map.str_to_response_payload
+
+@functools.lru_cache(maxsize=None)
+def _get_default_dp_headers(dp_model_name: str, port: int) -> Mapping[str, Union[str, int, float]]:
+    """Returns the default AnthemDp device headers advertised by an emulator of the given
+       model, listening on the given port, as a read-only mapping shared by all emulators."""
+    headers: Dict[str, Union[str, int, float]] = {
+        "Driver": f"receiver_nthemKENWOOD_{dp_model_name}.c4i",
+        "Host": "anthem_receiver-E0DADC152802",
+        "Manufacturer": "AnthemKENWOOD",
+        "Model": dp_model_name,
+        "Primary-Proxy": "receiver",
+        "Proxies": "receiver",
+        "Type": "AnthemKENWOOD:Receiver"
+    }
+    if port != DEFAULT_PORT:
+        # A nonstandard header is required to advertise nonstandard ports
+        headers["Port"] = port
+    return MappingProxyType(headers)
+
+def _build_response_from_payload(command: AnthemCommand, response_payload: bytes) -> AnthemResponse:
+    """Builds the response to a command from an advanced response payload. An empty
+       payload is allowed for basic commands."""
+    advanced_response_packet: Optional[RawPacket] = None
+    if command.is_advanced:
+        advanced_response_packet = command.create_advanced_response_packet(response_payload)
+    elif len(response_payload) > 0:
+        raise AnthemReceiverError(f"Payload provided for response to basic command {command}: {response_payload.hex(' ')}")
+    return AnthemResponse(command, command.create_basic_response_packet(), advanced_response_packet)
+
+def _build_response_from_str(command: AnthemCommand, gen_response: str) -> AnthemResponse:
+    """Builds the response to a command from a friendly advanced response string."""
+    response_payload = command.response_map.str_to_response_payload(gen_response)
+    if response_payload is None:
+        raise AnthemReceiverError(f"Unknown advanced string response '{gen_response}' for command {command}")
+    return _build_response_from_payload(command, response_payload)
+
+def _build_response_from_bool(command: AnthemCommand, gen_response: Optional[bool]) -> Optional[AnthemResponse]:
+    """Builds a basic response to a command for a None or True result, or no response
+       for a False result."""
+    if gen_response is False:
+        return None
+    return AnthemResponse(command, command.create_basic_response_packet(), None)
+
+def _build_response_as_is(command: AnthemCommand, gen_response: AnthemResponse) -> AnthemResponse:
+    """Uses a complete response returned by a command handler."""
+    return gen_response
+
+_response_builders: Dict[type, Callable[[AnthemCommand, Any], Optional[AnthemResponse]]] = {
+    bytes: _build_response_from_payload,
+    str: _build_response_from_str,
+    bool: _build_response_from_bool,
+    type(None): _build_response_from_bool,
+    AnthemResponse: _build_response_as_is,
+  }
+"""Builders that turn the result of AnthemReceiverEmulator.handle_command into the
+   response to send (or None to send nothing), keyed by the exact result type."""
+
+def _get_response_packets(response: Optional[AnthemResponse]) -> List[RawPacket]:
+    """Returns the packets to send for a response, in order; empty if response is None."""
+    if response is None:
+        return []
+    packets = [response.basic_response_packet]
+    if not response.advanced_response_packet is None:
+        packets.append(response.advanced_response_packet)
+    return packets
+
+def _get_response_builder(
+        command: AnthemCommand,
+        gen_response: EmulatorCommandResult
+      ) -> Callable[[AnthemCommand, Any], Optional[AnthemResponse]]:
+    """Returns the response builder for a command handler result."""
+    builder = _response_builders.get(type(gen_response))
+    if builder is None:
+        # Subclasses of the result types are rare; find the builder for the nearest base
+        for base_type in type(gen_response).__mro__[1:]:
+            builder = _response_builders.get(base_type)
+            if builder is not None:
+                break
+        else:
+            raise AnthemReceiverError(f"Invalid response type {type(gen_response)} for command {command}")
+    return builder
+
 class AnthemReceiverEmulator(AsyncContextManager['AnthemReceiverEmulator']):
     model: AnthemModel
     password: Optional[str]
     bind_addr: str
     port: int
-    sessions: Dict[int, AnthemReceiverEmulatorSession]
-    next_session_id: int = 0
-    requests: asyncio.Queue[Optional[Tuple[AnthemReceiverEmulatorSession, RawPacket]]]
+    sessions: weakref.WeakValueDictionary[int, AnthemReceiverEmulatorSession]
+    """Live sessions keyed by session ID. Sessions drop out when closed, or
+       when they are garbage collected if teardown never freed them."""
+    _session_id_gen: itertools.count[int]
+    requests: deque[Optional[Tuple[AnthemReceiverEmulatorSession, RawPacket, Optional[AnthemCommand]]]]
+    """Requests waiting for handle_requests, as (session, packet, command), where command is the
+       already parsed command, or None if the packet has not been parsed. None marks the end of requests."""
+    requests_event: asyncio.Event
+    """Set when requests are appended to an empty request queue."""
     server: Optional[asyncio.Server] = None
     handler_task: Optional[asyncio.Task[None]] = None
     server_task: Optional[asyncio.Task[None]] = None
@@ -54,14 +164,20 @@ class AnthemReceiverEmulator(AsyncContextManager['AnthemReceiverEmulator']):
     gamma_value_status_payload: bytes
     source_status_payload: bytes
 
+    _power_status_str: str
+    _input_status_str: str
+    _gamma_table_status_str: str
+    _gamma_value_status_str: str
+    _source_status_str: str
+
     power_status_query_meta = name_to_command_meta("power_status.query")
     input_status_query_meta = name_to_command_meta("input_status.query")
     gamma_table_status_query_meta = name_to_command_meta("gamma_table_status.query")
     gamma_value_status_query_meta = name_to_command_meta("gamma_value_status.query")
     source_status_query_meta = name_to_command_meta("source_status.query")
 
-    warmup_timer: Optional[asyncio.Task[None]] = None
-    cooldown_timer: Optional[asyncio.Task[None]] = None
+    warmup_timer: Optional[asyncio.TimerHandle] = None
+    cooldown_timer: Optional[asyncio.TimerHandle] = None
     dp_server_task: Optional[asyncio.Task[None]] = None
     with_dp: bool
     dp_multicast_address: str
@@ -69,6 +185,29 @@ class AnthemReceiverEmulator(AsyncContextManager['AnthemReceiverEmulator']):
     dp_bind_addresses: Optional[List[str]]
     dp_headers: Dict[str, Union[str, int, float]]
     dp_include_loopback: bool
+    command_handlers: Dict[str, EmulatorCommandHandler]
+    """Handlers for commands that need more than a default response, keyed by
+       full command name. Commands not in this table get a basic acknowledgement,
+       or the lowest valid advanced response payload."""
+    _status_query_payloads: Dict[str, Callable[[], bytes]]
+    """Functions that return the current advanced response payload for each status
+       query, keyed by full command name. The built-in status query handlers in
+       command_handlers and the answers given without queueing both come from here."""
+    _status_query_handlers: Dict[str, EmulatorCommandHandler]
+    """The built-in command_handlers entries for the status queries. A status query is
+       answered without queueing only while its entry in command_handlers is still
+       the built-in one."""
+    _sync_query_responses: Dict[Tuple[str, bytes], bytes]
+    """Raw response data already built for status queries answered without
+       queueing, keyed by (command name, advanced response payload). Each entry
+       is byte-for-byte what the queued path writes for the built-in handler's
+       payload. Status payloads come from small fixed sets, so this stays small."""
+    _handling_requests: bool = False
+    """True while handle_requests is working on a batch of requests."""
+    _parse_on_receive: bool
+    """True if handle_command and handle_request_packet are not overridden, so
+       packets are parsed once when they are received, and status queries with
+       built-in handlers can be answered without queueing."""
 
     def __init__(
             self,
@@ -100,8 +239,10 @@ class AnthemReceiverEmulator(AsyncContextManager['AnthemReceiverEmulator']):
         self.password = password
         self.bind_addr = '0.0.0.0' if bind_addr is None else bind_addr
         self.port = port
-        self.sessions = {}
-        self.requests = asyncio.Queue()
+        self.sessions = weakref.WeakValueDictionary()
+        self._session_id_gen = itertools.count()
+        self.requests = deque()
+        self.requests_event = asyncio.Event()
         self.final_result = asyncio.get_event_loop().create_future()
         self.warmup_time = warmup_time
         self.cooldown_time = cooldown_time if cooldown_time is not None else warmup_time
@@ -111,21 +252,31 @@ class AnthemReceiverEmulator(AsyncContextManager['AnthemReceiverEmulator']):
         self.dp_port = dp_port
         self.dp_bind_addresses = None if dp_bind_addresses is None else list(dp_bind_addresses)
         self.dp_include_loopback = dp_include_loopback
-        dp_model_name = self.model.dp_name
-        self.dp_headers = {
-            "Driver": f"receiver_nthemKENWOOD_{dp_model_name}.c4i",
-            "Host": "anthem_receiver-E0DADC152802",
-            "Manufacturer": "AnthemKENWOOD",
-            "Model": dp_model_name,
-            "Primary-Proxy": "receiver",
-            "Proxies": "receiver",
-            "Type": "AnthemKENWOOD:Receiver"
-        }
-        if self.port != DEFAULT_PORT:
-            # A nonstandard header is required to advertise nonstandard ports
-            self.dp_headers["Port"] = self.port
+        self.dp_headers = dict(_get_default_dp_headers(self.model.dp_name, self.port))
         if dp_headers is not None:
             self.dp_headers.update(dp_headers)
+        self._status_query_payloads = {
+            'model_status.query': lambda: self.model.model_status_payload,
+            'power_status.query': lambda: self.power_status_payload,
+            'input_status.query': lambda: self.input_status_payload,
+            'gamma_table_status.query': lambda: self.gamma_table_status_payload,
+            'gamma_value_status.query': lambda: self.gamma_value_status_payload,
+            'source_status.query': lambda: self.source_status_payload,
+          }
+        self._status_query_handlers = {
+            name: functools.partial(self._handle_status_query, get_payload)
+                for name, get_payload in self._status_query_payloads.items()
+          }
+        self.command_handlers = dict(self._status_query_handlers)
+        self.command_handlers.update({
+            'power.on': self._handle_power_on,
+            'power.off': self._handle_power_off,
+          })
+        self._sync_query_responses = {}
+        self._parse_on_receive = (
+            type(self).handle_command is AnthemReceiverEmulator.handle_command and
+            type(self).handle_request_packet is AnthemReceiverEmulator.handle_request_packet
+          )
         self.set_power_status_str(initial_power_status)
         self.set_input_status_str(initial_input_status)
         self.set_gamma_table_status_str(initial_gamma_table)
@@ -154,88 +305,92 @@ class AnthemReceiverEmulator(AsyncContextManager['AnthemReceiverEmulator']):
             logger.debug(f"AnthemDp server stopped prematurely")
             self.set_final_result(AnthemReceiverError("AnthemDp server stopped prematurely"))
 
-    def _start_one_shot_timer(
-            self,
-            delay: float,
-            callback: Callable[[], Coroutine[Any, Any, None]]
-          ) -> asyncio.Task[None]:
-        async def timer() -> None:
-            await asyncio.sleep(delay)
-            await callback()
-        return asyncio.create_task(timer())
-
-    async def _on_warmup_done(self) -> None:
+    def _cancel_timers(self) -> None:
+        """Cancels any pending warmup or cooldown timer."""
+        if self.warmup_timer is not None:
+            self.warmup_timer.cancel()
+            self.warmup_timer = None
+        if self.cooldown_timer is not None:
+            self.cooldown_timer.cancel()
+            self.cooldown_timer = None
+
+    def _on_warmup_done(self) -> None:
         self.warmup_timer = None
         if self.get_power_status_str() == "Warming":
             logger.info("Emulator warmup complete, powering on")
             self.set_power_status_str("On")
 
-    async def _on_cooldown_done(self) -> None:
+    def _on_cooldown_done(self) -> None:
         self.cooldown_timer = None
         if self.get_power_status_str() == "Cooling":
             logger.info("Emulator cooldown complete, entering standby")
             self.set_power_status_str("Standby")
 
     def get_power_status_str(self) -> str:
-        result = self.power_status_query_meta.response_map.response_payload_to_str(
-            self.power_status_payload)
-        assert result is not None
-        return result
+        return self._power_status_str
 
     def set_power_status_str(self, power_status: str) -> None:
         logger.debug(f"Setting receiver emulator power status to '{power_status}'")
-        if self.warmup_timer is not None:
-            self.warmup_timer.cancel()
-            self.warmup_timer = None
-        if self.cooldown_timer is not None:
-            self.cooldown_timer.cancel()
-            self.cooldown_timer = None
-        power_status_payload = self.power_status_query_meta.response_map.str_to_response_payload(
-            power_status)
+        self._cancel_timers()
+        power_status_payload = _power_status_str_to_payload(power_status)
         if power_status_payload is None:
             raise AnthemReceiverError(f"Unknown power status string '{power_status}'")
         self.power_status_payload = power_status_payload
+        self._power_status_str = power_status
         if not self.final_result.done():
             if power_status == "Warming":
-                self.warmup_timer = self._start_one_shot_timer(self.warmup_time, self._on_warmup_done)
+                self.warmup_timer = asyncio.get_running_loop().call_later(
+                    self.warmup_time, self._on_warmup_done)
             elif power_status == "Cooling":
-                self.cooldown_timer = self._start_one_shot_timer(self.cooldown_time, self._on_cooldown_done)
+                self.cooldown_timer = asyncio.get_running_loop().call_later(
+                    self.cooldown_time, self._on_cooldown_done)
+
+    def get_input_status_str(self) -> str:
+        return self._input_status_str
 
     def set_input_status_str(self, input_status: str) -> None:
         logger.debug(f"Setting receiver emulator input status to '{input_status}'")
-        input_status_payload = self.input_status_query_meta.response_map.str_to_response_payload(
-            input_status)
+        input_status_payload = _input_status_str_to_payload(input_status)
         if input_status_payload is None:
             raise AnthemReceiverError(f"Unknown input status string '{input_status}'")
         self.input_status_payload = input_status_payload
+        self._input_status_str = input_status
+
+    def get_gamma_table_status_str(self) -> str:
+        return self._gamma_table_status_str
 
     def set_gamma_table_status_str(self, gamma_table: str) -> None:
         logger.debug(f"Setting receiver emulator gamma table to '{gamma_table}'")
-        gamma_table_status_payload = self.gamma_table_status_query_meta.response_map.str_to_response_payload(
-            gamma_table)
+        gamma_table_status_payload = _gamma_table_status_str_to_payload(gamma_table)
         if gamma_table_status_payload is None:
             raise AnthemReceiverError(f"Unknown gamma table string '{gamma_table}'")
         self.gamma_table_status_payload = gamma_table_status_payload
+        self._gamma_table_status_str = gamma_table
+
+    def get_gamma_value_status_str(self) -> str:
+        return self._gamma_value_status_str
 
     def set_gamma_value_status_str(self, gamma_value: str) -> None:
         logger.debug(f"Setting receiver emulator gamma value to '{gamma_value}'")
-        gamma_value_status_payload = self.gamma_value_status_query_meta.response_map.str_to_response_payload(
-            gamma_value)
+        gamma_value_status_payload = _gamma_value_status_str_to_payload(gamma_value)
         if gamma_value_status_payload is None:
             raise AnthemReceiverError(f"Unknown gamma value string '{gamma_value}'")
         self.gamma_value_status_payload = gamma_value_status_payload
+        self._gamma_value_status_str = gamma_value
+
+    def get_source_status_str(self) -> str:
+        return self._source_status_str
 
     def set_source_status_str(self, source_status: str) -> None:
         logger.debug(f"Setting receiver emulator source status to '{source_status}'")
-        source_status_payload = self.source_status_query_meta.response_map.str_to_response_payload(
-            source_status)
+        source_status_payload = _source_status_str_to_payload(source_status)
         if source_status_payload is None:
             raise AnthemReceiverError(f"Unknown source status string '{source_status}'")
         self.source_status_payload = source_status_payload
+        self._source_status_str = source_status
 
     def alloc_session_id(self, session: AnthemReceiverEmulatorSession) -> int:
-        result = self.next_session_id
-        self.next_session_id += 1
+        result = next(self._session_id_gen)
         self.sessions[result] = session
         return result
 
@@ -243,14 +398,87 @@ class AnthemReceiverEmulator(AsyncContextManager['AnthemReceiverEmulator']):
         self.sessions.pop(session_id, None)
 
     def on_packet_received(self, session: AnthemReceiverEmulatorSession, packet: RawPacket) -> None:
-        """Called when a packet is received from a session."""
-        self.requests.put_nowait((session, packet))
+        """Called when a packet is received from a session.
+
+        Status queries with built-in handlers are answered immediately if no
+        other requests are queued or being handled, so that responses are
+        never reordered. Everything else goes through the request queue, along
+        with the parsed command so that it is not parsed again.
+        """
+        command: Optional[AnthemCommand] = None
+        if self._parse_on_receive:
+            command = self._parse_command_packet(packet)
+            if (command is not None and not self._handling_requests and len(self.requests) == 0 and
+                    not self.final_result.done()):
+                response_data = self._get_sync_query_response(session, command)
+                if response_data is not None:
+                    session.write(response_data)
+                    return
+        self._queue_request((session, packet, command))
+
+    def _queue_request(
+            self,
+            request: Optional[Tuple[AnthemReceiverEmulatorSession, RawPacket, Optional[AnthemCommand]]]
+          ) -> None:
+        """Adds a request (or None for end of requests) to the request queue and
+           wakes up handle_requests."""
+        self.requests.append(request)
+        self.requests_event.set()
+
+    def _parse_command_packet(self, packet: RawPacket) -> Optional[AnthemCommand]:
+        """Returns the command in a received packet, or None if it is not a valid
+           command packet. Invalid packets are left for handle_request_packet to report."""
+        if not packet.is_valid or not packet.is_command:
+            return None
+        try:
+            return AnthemCommand.create_from_command_packet(packet, model=self.model)
+        except Exception:
+            return None
+
+    def _get_sync_query_response(
+            self,
+            session: AnthemReceiverEmulatorSession,
+            command: AnthemCommand
+          ) -> Optional[bytes]:
+        """Returns the raw response data for a status query that can be answered
+           without queueing, or None if the command must be queued. Only status
+           queries whose command_handlers entry is still the built-in handler are
+           answered, so that replaced or removed handlers are always called."""
+        handler = self._status_query_handlers.get(command.name)
+        if handler is None or self.command_handlers.get(command.name) is not handler or not command.is_advanced:
+            return None
+        get_payload = self._status_query_payloads[command.name]
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"{session}: Answering {command.name} without queueing")
+        payload = get_payload()
+        key = (command.name, payload)
+        result = self._sync_query_responses.get(key)
+        if result is None:
+            # Built exactly as handle_request_packet and handle_requests would build and
+            # write the response to the built-in handler's payload
+            response = _get_response_builder(command, payload)(command, payload)
+            result = b''.join(packet.raw_data for packet in _get_response_packets(response))
+            self._sync_query_responses[key] = result
+        return result
+
+    async def _handle_status_query(
+            self,
+            get_payload: Callable[[], bytes],
+            session: AnthemReceiverEmulatorSession,
+            command: AnthemCommand
+          ) -> EmulatorCommandResult:
+        """Handle a status query command, and return the current status payload
+           from _status_query_payloads."""
+        payload = get_payload()
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"{session}: Responding to {command.name} with {payload.hex(' ')}")
+        return payload
 
     async def _handle_power_on(
             self,
             session: AnthemReceiverEmulatorSession,
             command: AnthemCommand
-          ) -> Union[AnthemResponse, bytes, str, None, bool]:
+          ) -> EmulatorCommandResult:
         """Handle a power.on command, and return a response.
 
         Transitions from Standby to Warming state.
@@ -259,7 +487,7 @@ class AnthemReceiverEmulator(AsyncContextManager['AnthemReceiverEmulator']):
               does not return any response and has no effect if the receiver
               is not in Standby mode.
         """
-        result: Union[AnthemResponse, bytes, str, None, bool]
+        result: EmulatorCommandResult
         if self.get_power_status_str() == "Standby":
             self.set_power_status_str("Warming")
             result = True
@@ -271,7 +499,7 @@ class AnthemReceiverEmulator(AsyncContextManager['AnthemReceiverEmulator']):
             self,
             session: AnthemReceiverEmulatorSession,
             command: AnthemCommand
-          ) -> Union[AnthemResponse, bytes, str, None, bool]:
+          ) -> EmulatorCommandResult:
         """Handle a power.off command, and return a response.
 
         Transitions from On to Cooling state.
@@ -280,7 +508,7 @@ class AnthemReceiverEmulator(AsyncContextManager['AnthemReceiverEmulator']):
               does not return any response and has no effect if the receiver
               is not in On mode.
         """
-        result: Union[AnthemResponse, bytes, str, None, bool]
+        result: EmulatorCommandResult
         if self.get_power_status_str() == "On":
             self.set_power_status_str("Cooling")
             result = True
@@ -292,7 +520,7 @@ class AnthemReceiverEmulator(AsyncContextManager['AnthemReceiverEmulator']):
             self,
             session: AnthemReceiverEmulatorSession,
             command: AnthemCommand
-          ) -> Union[AnthemResponse, bytes, str, None, bool]:
+          ) -> EmulatorCommandResult:
         """Handle a single command, and return a response.
         If a AnthemResponse is returned, it is used to form and send the response.
         If None, True, or a 0-byte bytes is returned, a basic response is sent.
@@ -301,108 +529,101 @@ class AnthemReceiverEmulator(AsyncContextManager['AnthemReceiverEmulator']):
            in the command's friendly string response table.
         """
 
-        result: Union[AnthemResponse, bytes, str, None, bool] = None
-
-        if command.name == 'model_status.query':
-            logger.debug(f"{session}: Responding to model_status.query with {self.model}")
-            result = self.model.model_status_payload
-        if command.name == 'power_status.query':
-            logger.debug(f"{session}: Responding to power_status.query with {self.get_power_status_str()}")
-            result = self.power_status_payload
-        elif command.name == 'power.on':
-            result = await self._handle_power_on(session, command)
-        elif command.name == 'power.off':
-            result = await self._handle_power_off(session, command)
+        result: EmulatorCommandResult = None
+
+        handler = self.command_handlers.get(command.name)
+        if handler is not None:
+            result = await handler(session, command)
+        elif not command.is_advanced:
+            # Just acknowledge any basic command
+            result = None
         else:
-            if not command.is_advanced:
-                # Just acknowledge any basic command
-                result = None
-            else:
-                # for advanced commands, just return the lowest sorted response payload
-                payload_set = command.response_map.valid_response_payloads()
-                if payload_set is None or len(payload_set) == 0:
-                    raise AnthemReceiverError(f"No valid response payloads for advanced command {command}")
-                payloads = sorted(payload_set)
-                result = payloads[0]
+            # for advanced commands, just return the lowest sorted response payload
+            result = command.response_map.default_response_payload()
+            if result is None:
+                raise AnthemReceiverError(f"No valid response payloads for advanced command {command}")
         return result
 
     async def handle_request_packet(
             self,
             session: AnthemReceiverEmulatorSession,
-            packet: RawPacket
+            packet: RawPacket,
+            command: Optional[AnthemCommand]=None
           ) -> Optional[List[RawPacket]]:
         """Handle a single request packet, and return response packets.
 
+        If command is provided, it is the already parsed command in packet.
         If an exception is raised, the session is closed.
         """
-        if not packet.is_valid:
-            raise AnthemReceiverError(f"Invalid request packet: {packet}")
-        if not packet.is_command:
-            raise AnthemReceiverError(f"Invalid command packet type {packet.raw_packet_type}: {packet}")
-
-        command = AnthemCommand.create_from_command_packet(packet, model=self.model)
-        logger.debug(f"{session}: Received command: {command}")
+        if command is None:
+            if not packet.is_valid:
+                raise AnthemReceiverError(f"Invalid request packet: {packet}")
+            if not packet.is_command:
+                raise AnthemReceiverError(f"Invalid command packet type {packet.raw_packet_type}: {packet}")
+
+            command = AnthemCommand.create_from_command_packet(packet, model=self.model)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"{session}: Received command: {command}")
         gen_response = await self.handle_command(session, command)
-        if isinstance(gen_response, bool) and not gen_response:
-            logger.debug(f"{session}: Sending NO response to command {command}")
-            packets: List[RawPacket] = []
-        else:
-            response: AnthemResponse
-            if isinstance(gen_response, AnthemResponse):
-                response = gen_response
+        response = _get_response_builder(command, gen_response)(command, gen_response)
+        if logger.isEnabledFor(logging.DEBUG):
+            if response is None:
+                logger.debug(f"{session}: Sending NO response to command {command}")
             else:
-                basic_response_packet = command.create_basic_response_packet()
-                advanced_response_packet: Optional[RawPacket] = None
-                if not gen_response is None and not isinstance(gen_response, bool):
-                    response_payload = b''
-                    if isinstance(gen_response, str):
-                        opt_response_payload = command.response_map.str_to_response_payload(
-                            gen_response)
-                        if opt_response_payload is None:
-                            raise AnthemReceiverError(f"Unknown advanced string response '{gen_response}' for command {command}")
-                        response_payload = opt_response_payload
-                    elif isinstance(gen_response, bytes):
-                        response_payload = gen_response
-                    else:
-                        raise AnthemReceiverError(f"Invalid response type {type(gen_response)} for command {command}")
-                    if command.is_advanced:
-                        advanced_response_packet = command.create_advanced_response_packet(response_payload)
-                    else:
-                        if len(response_payload) > 0:
-                            raise AnthemReceiverError(f"Payload provided for response to basic command {command}: {response_payload.hex(' ')}")
-                response = AnthemResponse(command, basic_response_packet, advanced_response_packet)
-
-            logger.debug(f"{session}: Sending response: {response}")
-            packets = [response.basic_response_packet]
-            if not response.advanced_response_packet is None:
-                packets.append(response.advanced_response_packet)
-
-        return packets
+                logger.debug(f"{session}: Sending response: {response}")
+
+        return _get_response_packets(response)
 
     async def handle_requests(self) -> None:
-        """Handle requests from sessions."""
-        while True:
-            session_and_packet = await self.requests.get()
+        """Handle requests from sessions.
+
+        Each wakeup drains every request that is already queued, and the
+        responses for a session are written with a single session.write()
+        at the end of the batch.
+        """
+        done = False
+        while not done:
+            while len(self.requests) == 0:
+                await self.requests_event.wait()
+                self.requests_event.clear()
+            batch = list(self.requests)
+            self.requests.clear()
+            pending_writes: Dict[AnthemReceiverEmulatorSession, List[bytes]] = {}
+            self._handling_requests = True
             try:
-                if session_and_packet is None:
-                    logger.debug("Emulator handler: Received EOF; exiting")
-                    break
-                session, packet = session_and_packet
-                try:
-                    logger.debug(f"{session}: Emulator handler: received packet: {packet}")
-                    response_packets = await self.handle_request_packet(session, packet)
-                    if not response_packets is None:
-                        for response_packet in response_packets:
-                            logger.debug(f"{session}: Emulator handler: Sending response packet: {response_packet}")
-                            session.write(response_packet.raw_data)
-                except asyncio.CancelledError as e:
-                    logger.debug(f"{session}: Handler task cancelled; exiting")
-                    break
-                except Exception as e:
-                    logger.exception(f"{session}: Handler task: Exception while handling request; killing session: {e}")
-                    break
+                for request in batch:
+                    if request is None:
+                        logger.debug("Emulator handler: Received EOF; exiting")
+                        done = True
+                        break
+                    session, packet, command = request
+                    try:
+                        if logger.isEnabledFor(logging.DEBUG):
+                            logger.debug(f"{session}: Emulator handler: received packet: {packet}")
+                        if command is None:
+                            # Unparsed, or handle_request_packet is overridden and may not accept a command
+                            response_packets = await self.handle_request_packet(session, packet)
+                        else:
+                            response_packets = await self.handle_request_packet(session, packet, command)
+                        if not response_packets is None:
+                            session_writes = pending_writes.setdefault(session, [])
+                            for response_packet in response_packets:
+                                if logger.isEnabledFor(logging.DEBUG):
+                                    logger.debug(f"{session}: Emulator handler: Sending response packet: {response_packet}")
+                                session_writes.append(response_packet.raw_data)
+                    except asyncio.CancelledError as e:
+                        logger.debug(f"{session}: Handler task cancelled; exiting")
+                        done = True
+                        break
+                    except Exception as e:
+                        logger.exception(f"{session}: Handler task: Exception while handling request; killing session: {e}")
+                        done = True
+                        break
             finally:
-                self.requests.task_done()
+                self._handling_requests = False
+                for session, session_writes in pending_writes.items():
+                    if len(session_writes) > 0:
+                        session.write(b''.join(session_writes))
 
     async def finish_start(self) -> None:
         """Called after the socket is up and running.  Subclasses can override to do additional
@@ -482,13 +703,8 @@ class AnthemReceiverEmulator(AsyncContextManager['AnthemReceiverEmulator']):
                 self.final_result.set_exception(exc)
             if self.dp_server_task is not None:
                 self.dp_server_task.cancel()
-            if self.warmup_timer is not None:
-                self.warmup_timer.cancel()
-                self.warmup_timer = None
-            if self.warmup_timer is not None:
-                self.cooldown_timer.cancel()
-                self.cooldown_timer = None
-            self.requests.put_nowait(None)
+            self._cancel_timers()
+            self._queue_request(None)
             if self.server is not None:
                 self.server.close()
 
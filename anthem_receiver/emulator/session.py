@@ -23,6 +23,7 @@ from ..protocol import (
     PJACK,
     PJNAK,
     END_OF_PACKET_BYTES,
+    MAX_PACKET_LENGTH,
   )
 from ..constants import DEFAULT_PORT
 
@@ -35,6 +36,10 @@ HANDSHAKE_TIMEOUT = 5.0
 IDLE_TIMEOUT = 30.0
 """Timeout for idle connections, after handshake."""
 
+RECEIVE_BUFFER_SIZE = 2 * (MAX_PACKET_LENGTH + 1)
+"""Initial size of each session's receive buffer. The buffer grows if a client
+   sends more than this without completing a packet."""
+
 class EmulatorSessionState(Enum):
     UNCONNECTED = 0
     SENDING_GREETING = 1
@@ -47,20 +52,34 @@ class EmulatorSessionState(Enum):
     SHUTTING_DOWN = 8
     CLOSED = 9
 
-class AnthemReceiverEmulatorSession(asyncio.Protocol):
+class AnthemReceiverEmulatorSession(asyncio.BufferedProtocol):
     session_id: int = -1
     emulator: AnthemReceiverEmulator
     transport: Optional[asyncio.Transport] = None
+    _loop: asyncio.AbstractEventLoop
+    """The event loop running the connection. Set when the connection is made."""
     peer_name: str = "<unconnected>"
     description: str = "EmulatorSession(<unconnected>)"
     state: EmulatorSessionState = EmulatorSessionState.UNCONNECTED
-    partial_data: bytes = b""
+    receive_buffer: bytearray
+    """Buffer that the transport reads received data directly into. Data that has
+       not yet been consumed as a complete packet is
+       receive_buffer[receive_start:receive_end]."""
+    receive_start: int = 0
+    receive_end: int = 0
+    receive_scanned: int = 0
+    """receive_buffer[receive_start:receive_scanned] is known not to contain an
+       END_OF_PACKET delimiter, so searches for the next one start here."""
     transport_closed: bool = True
     auth_timer: Optional[asyncio.TimerHandle] = None
+    valid_auth_data: bytes = PJREQ
+    """The authentication request expected from the client, including the password if any.
+       Computed when the connection is made."""
     idle_timer: Optional[asyncio.TimerHandle] = None
 
     def __init__(self, emulator: AnthemReceiverEmulator):
         self.emulator = emulator
+        self.receive_buffer = bytearray(RECEIVE_BUFFER_SIZE)
         self.session_id = emulator.alloc_session_id(self)
         self.description = f"EmulatorSession(id={self.session_id}, from=<unconnected>)"
 
@@ -78,22 +97,28 @@ class AnthemReceiverEmulatorSession(asyncio.Protocol):
         """Called when a connection is made.
 
         The argument is the transport representing the pipe connection.
-        To receive data, wait for data_received() calls.
+        To receive data, wait for buffer_updated() calls.
         When the connection is closed, connection_lost() is called.
         """
         assert isinstance(transport, asyncio.Transport)
         assert self.state == EmulatorSessionState.UNCONNECTED
         self.transport = transport
         self.transport_closed = False
+        self._loop = asyncio.get_running_loop()
         self.peer_name = transport.get_extra_info('peername')
+        valid_auth_data = PJREQ
+        password = self.password
+        if not password is None and len(password) > 0:
+            valid_auth_data += b'_' + password.encode('utf-8')
+        self.valid_auth_data = valid_auth_data
         self.description = f"EmulatorSession(id={self.session_id}, from='{self.peer_name}')"
         logger.debug(f"EmulatorSession: Connection from {self.peer_name}")
         self.state = EmulatorSessionState.SENDING_GREETING
         self.transport.write(PJ_OK)
         self.state = EmulatorSessionState.READING_AUTHENTICATION
-        self.auth_timer = asyncio.get_running_loop().call_later(
+        self.auth_timer = self._loop.call_later(
             HANDSHAKE_TIMEOUT,
-            lambda: self._on_auth_read_timeout())
+            self._on_auth_read_timeout)
 
     def close(self) -> None:
         if not self.state in (EmulatorSessionState.CLOSED, EmulatorSessionState.SHUTTING_DOWN):
@@ -120,35 +145,54 @@ class AnthemReceiverEmulatorSession(asyncio.Protocol):
             logger.debug(f"{self}: Idle timeout")
             self.close()
 
-    def data_received(self, data: bytes) -> None:
-        """Called when some data is received."""
+    def get_buffer(self, sizehint: int) -> memoryview:
+        """Called to allocate a new receive buffer.
+
+        Returns the free space at the end of receive_buffer, after moving any
+        unconsumed data to the front of the buffer and growing it if it is full.
+        """
+        buf = self.receive_buffer
+        if self.receive_start > 0:
+            nb_unconsumed = self.receive_end - self.receive_start
+            buf[:nb_unconsumed] = buf[self.receive_start:self.receive_end]
+            self.receive_scanned -= self.receive_start
+            self.receive_start = 0
+            self.receive_end = nb_unconsumed
+        if self.receive_end == len(buf):
+            buf.extend(bytes(len(buf)))
+        return memoryview(buf)[self.receive_end:]
+
+    def buffer_updated(self, nbytes: int) -> None:
+        """Called when the buffer was updated with the received data."""
         assert not self.transport is None
         try:
-            self.partial_data += data
-            i_eop = self.partial_data.find(END_OF_PACKET_BYTES)
+            self.receive_end += nbytes
+            buf = self.receive_buffer
+            start = self.receive_start
+            end = self.receive_end
+            # Only search data that has not been searched before. A delimiter that was
+            # already found but not yet consumed is at receive_scanned.
+            i_eop = buf.find(END_OF_PACKET_BYTES, max(start, self.receive_scanned), end)
+            self.receive_scanned = end if i_eop < 0 else i_eop
             if self.state == EmulatorSessionState.READING_AUTHENTICATION:
-                valid_auth_data = PJREQ
-                password = self.password
-                if not password is None and len(password) > 0:
-                    valid_auth_data += b'_' + password.encode('utf-8')
+                valid_auth_data = self.valid_auth_data
                 nb_auth = len(valid_auth_data)
-                if len(self.partial_data) >= nb_auth or (0 <= i_eop < nb_auth):
+                if end - start >= nb_auth or (0 <= i_eop < start + nb_auth):
                     if not self.auth_timer is None:
                         self.auth_timer.cancel()
                         self.auth_timer = None
-                    if 0 <= i_eop < nb_auth:
-                        auth_data = self.partial_data[:i_eop+1]
-                    else:
-                        auth_data = self.partial_data[:nb_auth]
-                    self.partial_data = self.partial_data[len(auth_data):]
-                    if auth_data == valid_auth_data:
+                    nb_auth_data = i_eop + 1 - start if 0 <= i_eop < start + nb_auth else nb_auth
+                    # Compare in place rather than copying the auth data out of the buffer
+                    is_valid_auth = nb_auth_data == nb_auth and buf.startswith(valid_auth_data, start, end)
+                    self.receive_start = start + nb_auth_data
+                    if is_valid_auth:
                         logger.debug(f"{self}: Authentication successful")
                         self.state = EmulatorSessionState.SENDING_AUTH_ACK
                         self.transport.write(PJACK)
                         self.state = EmulatorSessionState.READING_COMMAND
-                        self.idle_timer = asyncio.get_running_loop().call_later(
+                        self.idle_timer = self._loop.call_later(
                             IDLE_TIMEOUT,
-                            lambda: self._on_idle_read_timeout())
+                            self._on_idle_read_timeout)
                     else:
                         logger.debug(f"{self}: Authentication failed")
                         self.state = EmulatorSessionState.SENDING_AUTH_NAK
@@ -158,15 +202,21 @@ class AnthemReceiverEmulatorSession(asyncio.Protocol):
                 if not self.idle_timer is None:
                     self.idle_timer.cancel()
                     self.idle_timer = None
-                packet_bytes = self.partial_data[:i_eop + 1]
-                self.partial_data = self.partial_data[i_eop + 1:]
+                # Copy the packet straight out of the buffer, without an intermediate bytearray
+                with memoryview(buf) as view:
+                    packet_bytes = bytes(view[start:i_eop + 1])
+                self.receive_start = i_eop + 1
                 packet = RawPacket(packet_bytes)
                 self.state = EmulatorSessionState.RUNNING_COMMAND
                 self.emulator.on_packet_received(self, packet)
                 self.state = EmulatorSessionState.READING_COMMAND
-                self.idle_timer = asyncio.get_running_loop().call_later(
+                self.idle_timer = self._loop.call_later(
                     IDLE_TIMEOUT,
-                    lambda: self._on_idle_read_timeout())
+                    self._on_idle_read_timeout)
+            if self.receive_start == self.receive_end:
+                self.receive_start = 0
+                self.receive_end = 0
+                self.receive_scanned = 0
         except BaseException as e:
             logger.exception(f"{self}: Exception while processing data: {e}")
             self.close()
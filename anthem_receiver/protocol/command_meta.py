@@ -131,6 +131,14 @@ class ResponsePayloadMapper(ABC):
            is not a fixed set of valid payloads."""
         raise NotImplementedError()
 
+    def default_response_payload(self) -> Optional[bytes]:
+        """Returns the lowest sorted valid response payload, or None if there
+           is not a fixed, nonempty set of valid payloads."""
+        payloads = self.valid_response_payloads()
+        if payloads is None or len(payloads) == 0:
+            return None
+        return min(payloads)
+
     @abstractmethod
     def is_valid_response_payload(self, payload: bytes) -> bool:
         """Returns True if the given payload is a valid response payload."""
@@ -178,6 +186,9 @@ class FixedResponsePayloadMapper(ResponsePayloadMapper):
     _valid_payloads: Set[bytes]
     """A set of valid response payloads."""
 
+    _default_response_payload: Optional[bytes]
+    """The lowest sorted valid response payload, or None if there are none."""
+
     str_to_payload_map: Dict[str, bytes]
     """A mapping from string representations to response payloads."""
 
@@ -197,6 +208,7 @@ class FixedResponsePayloadMapper(ResponsePayloadMapper):
         super().__init__()
         self.payload_to_str_map = dict(payload_to_str_map)
         self._valid_payloads = set(payload_to_str_map.keys())
+        self._default_response_payload = min(self._valid_payloads) if len(self._valid_payloads) > 0 else None
         self.str_to_payload_map = {}
         for payload, str in payload_to_str_map.items():
             if str in self.str_to_payload_map:
@@ -207,6 +219,9 @@ class FixedResponsePayloadMapper(ResponsePayloadMapper):
     def valid_response_payloads(self) -> Optional[Set[bytes]]:
         return self._valid_payloads
 
+    def default_response_payload(self) -> Optional[bytes]:
+        return self._default_response_payload
+
     def is_valid_response_payload(self, payload: bytes) -> bool:
         return payload in self._valid_payloads
 
@@ -615,6 +630,10 @@ class CommandMeta:
        is also None, the command applies to all models. Updated when the command group
        is initialized."""
 
+    _packet_prefix: Optional[bytes] = None
+    """The complete packet prefix for this command. Computed when the command
+       group is set."""
+
     def __init__(
             self,
             name: str,
@@ -649,6 +668,7 @@ class CommandMeta:
     def command_group(self, value: CommandGroupMeta) -> None:
         assert self._command_group is None and value is not None
         self._command_group = value
+        self._packet_prefix = value.group_packet_prefix + self.command_additional_prefix
         if self.models_str is None:
             self.models_str = value.models_str
             self.models = value.models
@@ -678,7 +698,8 @@ class CommandMeta:
     def packet_prefix(self) -> bytes:
         """The complete packet prefix for this command, including the packet type, magic bytes,
            command_code, group_prefix, and command_additional_prefix."""
-        return self.command_group.group_packet_prefix + self.command_additional_prefix
+        assert self._packet_prefix is not None
+        return self._packet_prefix
 
     @property
     def packet_prefix_length(self) -> int:
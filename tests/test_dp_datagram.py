@@ -0,0 +1,35 @@
+#
+# Copyright (c) 2023 Samuel J. McKelvie
+#
+# MIT License - See LICENSE file accompanying this package.
+#
+
+"""
+Tests for anthem_receiver.discovery.dp_datagram
+"""
+
+from __future__ import annotations
+
+from anthem_receiver.discovery import AnthemDpDatagram
+
+def test_raw_view_is_not_changed_by_later_modification() -> None:
+    datagram = AnthemDpDatagram(device_name='Before', tcp_port=14999)
+    view = datagram.raw_view
+    sent = bytes(view)
+    assert view.readonly
+
+    datagram.device_name = 'After'
+    datagram.tcp_port = 1234
+
+    # A transport may still hold the view; it must keep the contents as they were when sent
+    assert bytes(view) == sent
+    assert datagram.device_name == 'After'
+    assert datagram.tcp_port == 1234
+    assert AnthemDpDatagram.from_raw(bytes(datagram.raw_view)).device_name == 'After'
+
+def test_raw_view_is_reused_until_modified() -> None:
+    datagram = AnthemDpDatagram()
+    view = datagram.raw_view
+    assert datagram.raw_view is view
+    datagram.is_off = True
+    assert datagram.raw_view is not view
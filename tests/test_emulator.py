@@ -0,0 +1,124 @@
+#
+# Copyright (c) 2023 Samuel J. McKelvie
+#
+# MIT License - See LICENSE file accompanying this package.
+#
+
+"""
+Tests for anthem_receiver.emulator request handling
+"""
+
+from __future__ import annotations
+
+import asyncio
+import pytest
+
+from anthem_receiver.internal_types import *
+
+# The emulator depends on packages that are not always installed
+pytest.importorskip("anthem_receiver.emulator")
+
+from anthem_receiver.emulator import AnthemReceiverEmulator
+from anthem_receiver.emulator.session import AnthemReceiverEmulatorSession
+from anthem_receiver.protocol import AnthemCommand, name_to_command_meta
+
+STATUS_QUERIES = [
+    'model_status.query',
+    'power_status.query',
+    'input_status.query',
+    'gamma_table_status.query',
+    'gamma_value_status.query',
+    'source_status.query',
+  ]
+
+def _status_payload(query_name: str, status: str) -> bytes:
+    payload = name_to_command_meta(query_name).response_map.str_to_response_payload(status)
+    assert payload is not None
+    return payload
+
+async def _request(
+        emulator: AnthemReceiverEmulator,
+        session: AnthemReceiverEmulatorSession,
+        command_name: str
+      ) -> Tuple[AnthemCommand, bytes]:
+    """Runs a command through handle_request_packet, and returns the command and the
+       response bytes that would be written to the session."""
+    command = AnthemCommand.create_from_name(command_name)
+    packets = await emulator.handle_request_packet(session, command.command_packet)
+    assert packets is not None
+    return command, b''.join(packet.raw_data for packet in packets)
+
+def _expected_advanced_response(command: AnthemCommand, payload: bytes) -> bytes:
+    return command.create_basic_response_packet().raw_data + command.create_advanced_response_packet(payload).raw_data
+
+def test_power_on_off() -> None:
+    async def run() -> None:
+        emulator = AnthemReceiverEmulator(with_dp=False, warmup_time=60.0)
+        try:
+            session = AnthemReceiverEmulatorSession(emulator)
+
+            command, response = await _request(emulator, session, 'power_status.query')
+            assert response == _expected_advanced_response(command, _status_payload('power_status.query', 'Standby'))
+
+            command, response = await _request(emulator, session, 'power.on')
+            assert response == command.create_basic_response_packet().raw_data
+            assert emulator.get_power_status_str() == 'Warming'
+
+            command, response = await _request(emulator, session, 'power_status.query')
+            assert response == _expected_advanced_response(command, _status_payload('power_status.query', 'Warming'))
+
+            # power.on and power.off are ignored, with no response, unless in Standby and On respectively
+            _, response = await _request(emulator, session, 'power.on')
+            assert response == b''
+            _, response = await _request(emulator, session, 'power.off')
+            assert response == b''
+            assert emulator.get_power_status_str() == 'Warming'
+
+            emulator.set_power_status_str('On')
+            command, response = await _request(emulator, session, 'power.off')
+            assert response == command.create_basic_response_packet().raw_data
+            assert emulator.get_power_status_str() == 'Cooling'
+        finally:
+            emulator.close()
+    asyncio.run(run())
+
+def test_model_status_query() -> None:
+    async def run() -> None:
+        emulator = AnthemReceiverEmulator(with_dp=False)
+        try:
+            session = AnthemReceiverEmulatorSession(emulator)
+            command, response = await _request(emulator, session, 'model_status.query')
+            assert response == _expected_advanced_response(command, emulator.model.model_status_payload)
+        finally:
+            emulator.close()
+    asyncio.run(run())
+
+def test_status_queries_answered_the_same_with_and_without_queueing() -> None:
+    async def run() -> None:
+        emulator = AnthemReceiverEmulator(with_dp=False, initial_input_status='HDMI 2')
+        try:
+            session = AnthemReceiverEmulatorSession(emulator)
+            for query_name in STATUS_QUERIES:
+                command, queued_response = await _request(emulator, session, query_name)
+                assert emulator._get_sync_query_response(session, command) == queued_response
+        finally:
+            emulator.close()
+    asyncio.run(run())
+
+def test_replaced_status_query_handler_is_not_bypassed() -> None:
+    async def run() -> None:
+        emulator = AnthemReceiverEmulator(with_dp=False)
+        try:
+            session = AnthemReceiverEmulatorSession(emulator)
+            on_payload = _status_payload('power_status.query', 'On')
+
+            async def always_on(session: AnthemReceiverEmulatorSession, command: AnthemCommand) -> bytes:
+                return on_payload
+
+            emulator.command_handlers['power_status.query'] = always_on
+            command, response = await _request(emulator, session, 'power_status.query')
+            assert response == _expected_advanced_response(command, on_payload)
+            assert emulator._get_sync_query_response(session, command) is None
+        finally:
+            emulator.close()
+    asyncio.run(run())